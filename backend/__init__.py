@@ -1,19 +1,85 @@
-from flask import render_template, Flask
-from flask_sqlalchemy import SQLAlchemy
+import os
+import sqlite3
+
+from flask import render_template, request, Flask
+from flask_sqlalchemy import SQLAlchemy, get_debug_queries
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
 
 app = Flask("frontend") # FIXME: Finish rearranging frontend/backend modules properly instead of pretending to be frontend in backend/__init__ because jinja templates are looked for from <what_is_passed_here>/templates
-app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///../backend/grumpy.db" # FIXME: configuration support; weird ../ because of claiming we are "frontend" to Flask and want to keep the path the same it was before for now. But this problem should go away with config, at least for postgres :)
+app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///../backend/grumpy.db" # Default DB; weird ../ because of claiming we are "frontend" to Flask and want to keep the path the same it was before for now
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'Change me, you fool'
+app.config['PAGE_SIZE'] = 100 # Default number of entries on paginated listings; ?per_page= overrides it up to MAX_PAGE_SIZE
+app.config['MAX_PAGE_SIZE'] = 1000
+app.config['PAGE_CACHE_SIZE'] = 1000 # Rendered pages kept in memory per process; 0 disables the page cache
+app.config['PAGE_CACHE_DIR'] = None # Optional directory to share rendered pages between worker processes
+app.config['PROFILE_REQUESTS'] = False # Record per route latency, SQL and template times, served at /stats/profile
+# Set on every new SQLite connection; WAL lets the site keep serving the last committed data while a sync writes
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL', # Safe with WAL; a power loss can only lose the last commits
+    'busy_timeout': 10000, # ms a writer waits for another one, e.g. saving follows while a sync commits
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024, # Negative means KiB, per connection
+}
+app.config['SQLITE_POOL_SIZE'] = 5 # Connections kept open, along with their page cache, instead of a new one per request
+# Local configuration overrides from the python file named by $GRUMPY_SETTINGS, e.g. SQLALCHEMY_DATABASE_URI = "postgresql://grumpy@/grumpy"
+app.config.from_envvar('GRUMPY_SETTINGS', silent=True)
+if 'GRUMPY_DATABASE_URL' in os.environ:
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['GRUMPY_DATABASE_URL']
+database_url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+if database_url.get_backend_name() == 'sqlite' and database_url.database not in (None, '', ':memory:'):
+    # Flask-SQLAlchemy otherwise opens a new connection per request for SQLite files; pooled ones get handed between threads
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {'poolclass': QueuePool, 'pool_size': app.config['SQLITE_POOL_SIZE'],
+                                                        'connect_args': {'check_same_thread': False}})
 db = SQLAlchemy(app)
 
+class BitOrAggregate(object):
+    """bit_or() aggregate as built into PostgreSQL, for combining the arch bitmasks of versions"""
+    def __init__(self):
+        self.value = 0
+
+    def step(self, value):
+        if value is not None:
+            self.value |= value
+
+    def finalize(self):
+        return self.value
+
+@db.event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in app.config['SQLITE_PRAGMAS'].items():
+            cursor.execute("PRAGMA %s = %s" % (pragma, value))
+        cursor.close()
+        dbapi_connection.create_aggregate('bit_or', 1, BitOrAggregate)
+
 from frontend import *
 
 GrumpyView.register(app)
 SetupView.register(app)
+DashboardView.register(app)
+StatsView.register(app)
+ApiView.register(app)
+
+if app.config['PROFILE_REQUESTS']:
+    RequestProfiler(app, db)
 
 __all__ = ["app", "db"]
 
 @app.errorhandler(404)
 def not_found(error):
     return render_template('404.html'), 404
+
+@app.after_request
+def report_queries(response):
+    # Queries are only recorded in debug or testing mode (or with SQLALCHEMY_RECORD_QUERIES)
+    queries = get_debug_queries()
+    if queries:
+        query_time = sum(query.duration for query in queries)
+        response.headers['X-Query-Count'] = str(len(queries))
+        response.headers['X-Query-Time'] = "%.1fms" % (query_time * 1000)
+        app.logger.debug("%s %s: %d queries in %.1fms", request.method, request.path, len(queries), query_time * 1000)
+    return response
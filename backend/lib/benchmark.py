@@ -0,0 +1,170 @@
+import json
+import random
+
+from .. import app, db
+from .models import Category, Maintainer, Package, PackageVersion, PkgCheck, maintainer_project_membership_rel_table
+from .sync import apply_package_changes, batches, lookup_ids, mark_synced, rebuild_maintainer_closure, replace_links, upsert
+
+# Keywords of the Gentoo tree; the first ones are used, padded with made up ones if more are asked for
+ARCHES = ['amd64', 'x86', 'arm64', 'arm', 'ppc64', 'ppc', 'riscv', 'sparc', 'alpha', 'hppa', 'ia64', 'loong', 'm68k', 'mips', 's390',
+          'amd64-linux', 'arm-linux', 'arm64-linux', 'ppc64-linux', 'riscv-linux', 'x86-linux', 'arm64-macos', 'ppc-macos', 'x64-macos',
+          'x64-solaris', 'x86-solaris', 'sparc-solaris', 'sparc64-solaris', 'x64-cygwin', 'x86-winnt']
+PKGCHECK_CLASSES = ['DeprecatedEapi', 'MissingSlotDep', 'RedundantVersion', 'UnstableOnlyKeywords', 'UnusedLocalUseFlag',
+                    'VariableScope', 'MissingRemoteId', 'BadDescription', 'DroppedKeywords', 'StableRequest']
+WORDS = ['library', 'python', 'bindings', 'tool', 'server', 'client', 'parser', 'daemon', 'network', 'graphics', 'audio', 'video',
+         'compression', 'crypto', 'terminal', 'editor', 'font', 'theme', 'plugin', 'kernel', 'driver', 'database', 'web', 'framework']
+REGRESSION_SLACK_MS = 1.0 # p95 increases below this are considered noise regardless of the tolerance
+
+
+def package_versions(rnd, count, arch_names):
+    """Versions of one synthetic package, oldest first, the older ones being stable on more of its arches"""
+    major, minor = rnd.randint(0, 12), rnd.randint(0, 12)
+    package_arches = rnd.sample(arch_names, rnd.randint(1, len(arch_names)))
+    versions = []
+    for i in range(count):
+        minor += rnd.randint(1, 3)
+        version = "%d.%d%s" % (major, minor, rnd.choice(['', '', '', '-r1', '_rc1', '_p20240101', '.1']))
+        stable_share = 1 - i / count
+        keywords = [arch if rnd.random() < stable_share else '~' + arch for arch in package_arches if rnd.random() < 0.9]
+        versions.append({'version': version, 'keywords': keywords})
+    return versions
+
+def generate_tree(categories=160, packages_per_category=125, versions_per_package=3, arches=40, developers=400, projects=60,
+                  pkgcheck_results=50000, seed=0):
+    """Fill an empty database with a synthetic tree of the given size, derived data included.
+
+    Packages go through the same apply_package_changes as synced ones, so keyword
+    bitmasks, version sort keys, the search index and maintainer closure are all there.
+    """
+    rnd = random.Random(seed)
+    arch_names = (ARCHES + ["arch%d" % i for i in range(len(ARCHES), arches)])[:arches]
+
+    developer_emails = ["dev%d@gentoo.org" % i for i in range(developers)]
+    project_emails = ["project%d@gentoo.org" % i for i in range(projects)]
+    upsert(Maintainer, [{'email': email, 'is_project': False, 'name': "Developer %d" % i} for i, email in enumerate(developer_emails)], ['email'])
+    upsert(Maintainer, [{'email': email, 'is_project': True, 'name': "Project %d" % i} for i, email in enumerate(project_emails)], ['email'])
+    maintainer_ids = lookup_ids(Maintainer, Maintainer.email, developer_emails + project_emails)
+    memberships = set()
+    for i, email in enumerate(project_emails):
+        for member in rnd.sample(developer_emails, rnd.randint(3, 15)):
+            memberships.add((maintainer_ids[email], maintainer_ids[member], False))
+        if i and rnd.random() < 0.3:
+            # Some projects are subprojects of an earlier one, counting as its members
+            memberships.add((maintainer_ids[project_emails[rnd.randrange(i)]], maintainer_ids[email], True))
+    rel = maintainer_project_membership_rel_table
+    replace_links(rel, [rel.c.project_id, rel.c.maintainer_id, rel.c.inherit_members], [maintainer_ids[email] for email in project_emails], memberships)
+
+    category_names = ["%s-%s" % (rnd.choice(['app', 'dev', 'media', 'net', 'sys', 'x11', 'games', 'sci']), "%s%d" % (rnd.choice(WORDS), i))
+                      for i in range(categories)]
+    upsert(Category, [{'name': name, 'description': "Synthetic category %s" % name} for name in category_names], ['name'])
+    keyword_ids = {}
+    for category_name, category_id in sorted(lookup_ids(Category, Category.name, category_names).items()):
+        names = ["%s%d" % (rnd.choice(WORDS), i) for i in range(packages_per_category)]
+        upsert(Package, [{'category_id': category_id, 'name': name} for name in names], ['category_id', 'name'])
+        changes = []
+        for package in Package.query.filter_by(category_id=category_id):
+            maintainers = rnd.sample(developer_emails, rnd.randint(0, 2)) + rnd.sample(project_emails, rnd.choice([0, 0, 1]))
+            changes.append((package, {
+                'description': " ".join(["Synthetic", package.name] + rnd.sample(WORDS, 4)),
+                'maintainers': [(email, email in project_emails, None) for email in maintainers],
+                'versions': package_versions(rnd, versions_per_package, arch_names),
+            }))
+        apply_package_changes(changes, maintainer_ids, keyword_ids)
+        db.session.commit()
+    rebuild_maintainer_closure()
+
+    versions = db.session.query(PackageVersion.id, PackageVersion.package_id, Package.category_id).join(PackageVersion.package).all()
+    rows = []
+    for i in range(pkgcheck_results):
+        version_id, package_id, category_id = rnd.choice(versions)
+        violationclass = rnd.choice(PKGCHECK_CLASSES)
+        rows.append({'category_id': category_id, 'package_id': package_id, 'version_id': version_id if rnd.random() < 0.7 else None,
+                     'violationclass': violationclass, 'message': "%s: synthetic result %d" % (violationclass, i)})
+    for batch in batches(rows, 5000):
+        db.session.execute(PkgCheck.__table__.insert(), batch)
+    mark_synced('benchmark')
+    db.session.commit()
+    print("Generated %d categories, %d packages, %d versions over %d arches, %d maintainers and %d pkgcheck results" % (
+        categories, categories * packages_per_category, len(versions), arches, developers + projects, pkgcheck_results))
+
+def benchmark_routes(rnd, samples=50):
+    """Return (method, url or url function of the iteration, form data) of the pages to benchmark, with arguments sampled from the DB"""
+    packages = rnd.sample([tuple(row) for row in db.session.query(Category.name, Package.name).join(Package.category).order_by(Package.id)], samples)
+    categories = [category for category, name in packages]
+    maintainer_counts = db.session.query(Maintainer.email, db.func.count()).join(Maintainer.directly_maintained_packages) \
+        .group_by(Maintainer.email).order_by(db.func.count().desc(), Maintainer.email).limit(samples).all()
+    emails = [email for email, count in maintainer_counts]
+    follows = [id for id, in db.session.query(Maintainer.id).filter(Maintainer.email.in_(emails[:30]))]
+    queries = [name[:length] for category, name in packages for length in (2, 4, len(name))]
+
+    def cycle(values, url):
+        return lambda i: url % values[i % len(values)]
+    return [
+        ('GET', '/', None),
+        ('GET', cycle(categories, '/category/%s'), None),
+        ('GET', cycle(packages, '/package/%s/%s'), None),
+        ('GET', cycle(emails, '/maintainer/%s'), None),
+        ('GET', '/maintainers', None),
+        ('GET', cycle(queries, '/search?q=%s'), None),
+        ('POST', '/setup/', {'maintainers': [str(id) for id in follows]}),
+        ('GET', '/setup/', None),
+        ('GET', '/dashboard/', None),
+        ('GET', '/api/v1/', None),
+        ('GET', cycle(categories, '/api/v1/category/%s'), None),
+        ('GET', cycle(packages, '/api/v1/package/%s/%s'), None),
+        ('GET', cycle(emails, '/api/v1/maintainer/%s'), None),
+        ('GET', cycle(queries, '/api/v1/search?q=%s'), None),
+        ('GET', '/api/v1/reports/keywords?arch=arm64', None),
+    ]
+
+def run_benchmark(requests=20, page_cache=False, seed=0):
+    """Request every page `requests` times through the test client and return the RequestProfiler stats.
+
+    Each page is requested once before measuring, so that per-generation caches are
+    warm. The page cache is disabled unless page_cache, to measure the actual rendering.
+    """
+    from frontend.profiling import RequestProfiler
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    if not page_cache:
+        app.config['PAGE_CACHE_SIZE'] = 0
+        app.extensions.pop('page_cache', None)
+    profiler = app.extensions.get('profiler') or RequestProfiler(app, db)
+    with app.app_context():
+        routes = benchmark_routes(random.Random(seed))
+    client = app.test_client()
+    for i in range(requests + 1):
+        if i == 1:
+            profiler.reset()
+        for method, url, data in routes:
+            path = url(i) if callable(url) else url
+            response = client.open(path, method=method, data=data, buffered=True)
+            if response.status_code not in (200, 302):
+                raise RuntimeError("%s %s returned %s" % (method, path, response.status))
+    return profiler.stats()
+
+def print_benchmark(stats, baseline=None, tolerance=1.5):
+    """Print the run_benchmark stats, comparing to those of a baseline run if given; returns 1 if any route regressed"""
+    status = 0
+    print("%-50s %8s %8s %8s %8s %8s" % ("route", "p50 ms", "p95 ms", "sql ms", "tmpl ms", "queries"))
+    for route, route_stats in stats.items():
+        note = ""
+        before = (baseline or {}).get(route)
+        if before:
+            if route_stats['p95_ms'] > max(before['p95_ms'] * tolerance, before['p95_ms'] + REGRESSION_SLACK_MS):
+                note += " SLOWER (p95 was %.2f)" % before['p95_ms']
+            if route_stats['queries'] > before['queries']:
+                note += " MORE QUERIES (was %s)" % before['queries']
+        if note:
+            status = 1
+        print("%-50s %8.2f %8.2f %8.2f %8.2f %8s%s" % (route, route_stats['p50_ms'], route_stats['p95_ms'], route_stats['sql_ms'],
+                                                     route_stats['template_ms'], route_stats['queries'], note))
+    return status
+
+def load_benchmark(path):
+    with open(path) as f:
+        return json.load(f)
+
+def save_benchmark(stats, path):
+    with open(path, 'w') as f:
+        json.dump(stats, f, indent=2, sort_keys=True)
@@ -0,0 +1,140 @@
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import wraps
+
+from .. import db
+from .models import SyncRun
+
+
+class SyncFailed(Exception):
+    """Raised by a sync function when its source data as a whole couldn't be retrieved or understood"""
+
+class SyncJournal(object):
+    """Progress bookkeeping of one sync run, persisted as a SyncRun row.
+
+    Counters and phase durations are kept in memory and written out with every
+    checkpoint(), which also commits the sync's own pending changes, so the journal
+    always describes exactly what has been committed.
+    """
+    def __init__(self, source, resumable=False):
+        previous = SyncRun.query.filter_by(source=source).order_by(SyncRun.id.desc()).first()
+        # Whether the previous run failed or was killed, possibly leaving derived data behind its committed changes
+        self.interrupted = previous is not None and previous.status != 'finished'
+        # Checkpoint of an interrupted previous run to continue from, if any and the sync knows how to
+        self.resume_from = previous.checkpoint if self.interrupted and resumable else None
+        now = datetime.utcnow()
+        self.run = SyncRun(source=source, status='running', started_ts=now, updated_ts=now, checkpoint=self.resume_from)
+        self.processed = 0
+        self.failed = 0
+        self.bytes_downloaded = 0
+        self.phases = defaultdict(float)
+        db.session.add(self.run)
+        db.session.commit()
+        if self.resume_from:
+            print("Resuming interrupted %s sync after %s" % (source, self.resume_from))
+
+    def downloaded(self, response):
+        if response is not None and hasattr(response.raw, 'tell'):
+            self.bytes_downloaded += response.raw.tell()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.monotonic() - start
+
+    def timed(self, iterable, name):
+        """Iterate over iterable, accounting the time spent waiting for items to phase name"""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def _write(self, checkpoint=None):
+        self.run.updated_ts = datetime.utcnow()
+        if checkpoint is not None:
+            self.run.checkpoint = checkpoint
+        self.run.items_processed = self.processed
+        self.run.items_failed = self.failed
+        self.run.bytes_downloaded = self.bytes_downloaded
+        self.run.phase_durations = json.dumps(dict(self.phases), sort_keys=True)
+
+    def checkpoint(self, key=None):
+        """Commit the pending sync changes along with the progress up to item key"""
+        with self.phase('commit'):
+            self._write(key)
+            db.session.commit()
+
+    def finish(self, status):
+        self._write()
+        self.run.status = status
+        self.run.finished_ts = datetime.utcnow()
+        if status == 'finished':
+            self.run.checkpoint = None
+        db.session.commit()
+
+def journaled(source, resumable=False):
+    """Decorator running a sync function with a SyncJournal passed as journal keyword argument.
+
+    The run is marked finished when the function returns; if it raises, the open
+    transaction is rolled back and the run marked failed, keeping its last checkpoint
+    for the next run to resume from if the sync is resumable, i.e. continues after
+    journal.resume_from. A SyncFailed is only printed, not propagated.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            journal = SyncJournal(source, resumable)
+            try:
+                result = func(*args, journal=journal, **kwargs)
+            except SyncFailed as e:
+                print(e)
+                db.session.rollback()
+                journal.failed += 1
+                journal.finish('failed')
+                return None
+            except BaseException:
+                db.session.rollback()
+                journal.finish('failed')
+                raise
+            journal.finish('finished')
+            return result
+        return wrapper
+    return decorator
+
+def format_duration(seconds):
+    return "%dh%02dm%02ds" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+def print_sync_status(limit=10, stalled_minutes=30):
+    """Print the latest sync runs per source; returns 1 if any source's latest run failed or stalled, else 0"""
+    now = datetime.utcnow()
+    status = 0
+    sources = [source for source, in db.session.query(SyncRun.source).distinct().order_by(SyncRun.source)]
+    if not sources:
+        print("No sync runs recorded yet")
+    for source in sources:
+        print("%s:" % source)
+        runs = SyncRun.query.filter_by(source=source).order_by(SyncRun.id.desc()).limit(limit).all()
+        for i, run in enumerate(runs):
+            state = run.status
+            if run.status == 'running' and now - run.updated_ts > timedelta(minutes=stalled_minutes):
+                state = 'STALLED'
+            if i == 0 and state in ('failed', 'STALLED'):
+                status = 1
+            duration = ((run.finished_ts or now) - run.started_ts).total_seconds()
+            print("  #%d %-8s started %s UTC, %s, %d processed, %d failed, %.1f MiB downloaded%s" % (
+                run.id, state, run.started_ts.strftime('%Y-%m-%d %H:%M:%S'), format_duration(duration),
+                run.items_processed, run.items_failed, run.bytes_downloaded / 1024 / 1024,
+                ", checkpoint %s" % run.checkpoint if run.checkpoint else ""))
+            if run.phases:
+                print("      phases: %s" % ", ".join("%s %.1fs" % item for item in sorted(run.phases.items())))
+    return status
@@ -0,0 +1,224 @@
+import hashlib
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+from .. import db
+from .journal import journaled
+from .models import Category, Keyword, Package, PackageVersion
+from .search import index_new_packages
+from .sync import SYNC_TRANSACTION_SIZE, apply_package_changes, load_http_cache, mark_synced, normalize_package, rebuild_maintainer_closure, reconcile_versions, \
+    remember_many_validators, upsert
+from .versions import try_version_sort_key
+
+# Plain top-level assignments in ebuilds, for the case there is no metadata/md5-cache entry
+EBUILD_VAR_RE = re.compile(r'^\s*(DESCRIPTION|KEYWORDS)=(["\']?)(.*?)\2\s*$', re.MULTILINE)
+
+
+def read_categories(repo):
+    """Return the category names listed in profiles/categories of the repository at repo"""
+    with open(os.path.join(repo, 'profiles', 'categories')) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+def category_description(repo, category):
+    """Return the English longdescription from the category metadata.xml, if any"""
+    try:
+        root = ET.parse(os.path.join(repo, category, 'metadata.xml')).getroot()
+    except (OSError, ET.ParseError):
+        return None
+    for elem in root.iter('longdescription'):
+        if elem.get('lang', 'en') == 'en' and elem.text:
+            return " ".join(elem.text.split())
+    return None
+
+def read_md5_cache(path):
+    """Return the KEY=value entries of a metadata/md5-cache file as a dict"""
+    entries = {}
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            key, sep, value = line.rstrip('\n').partition('=')
+            if sep:
+                entries[key] = value
+    return entries
+
+def read_ebuild_vars(path):
+    """Return DESCRIPTION and KEYWORDS as assigned in an ebuild; the last assignment wins"""
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return {key: value for key, quote, value in EBUILD_VAR_RE.findall(f.read())}
+
+def read_maintainers(path):
+    """Return the maintainers of a package metadata.xml in the shape of packages.gentoo.org JSON"""
+    try:
+        root = ET.parse(path).getroot()
+    except (OSError, ET.ParseError):
+        return []
+    maintainers = []
+    for elem in root.findall('maintainer'):
+        maint = {}
+        if 'type' in elem.attrib:
+            maint['type'] = elem.attrib['type']
+        for child in elem:
+            if child.tag in ('email', 'name') and child.text:
+                maint[child.tag] = child.text.strip()
+        maintainers.append(maint)
+    return maintainers
+
+def scan_package(repo, category, name):
+    """Find the files of one package of the repository at repo, without reading them.
+
+    Returns (fingerprint, versions, metadata_xml), with versions a list of
+    (version, ebuild path, md5-cache path or None) tuples and fingerprint the newest
+    mtime among the package directory, those files and metadata.xml; or None if the
+    package has no ebuilds.
+    """
+    pkg_dir = os.path.join(repo, category, name)
+    mtimes = [os.stat(pkg_dir).st_mtime_ns]
+    versions = []
+    metadata_xml = None
+    for entry in os.scandir(pkg_dir):
+        if entry.name.endswith('.ebuild') and entry.name.startswith(name + '-'):
+            version = entry.name[len(name) + 1:-len('.ebuild')]
+            cache_file = os.path.join(repo, 'metadata', 'md5-cache', category, "%s-%s" % (name, version))
+            try:
+                mtimes.append(os.stat(cache_file).st_mtime_ns)
+            except OSError:
+                cache_file = None
+            versions.append((version, entry.path, cache_file))
+        elif entry.name == 'metadata.xml':
+            metadata_xml = entry.path
+        else:
+            continue
+        mtimes.append(entry.stat().st_mtime_ns)
+    if not versions:
+        return None
+    return str(max(mtimes)), versions, metadata_xml
+
+def read_package(versions, metadata_xml):
+    """Read the package files found by scan_package into the shape of the packages.gentoo.org package JSON"""
+    pkg = {'maintainers': read_maintainers(metadata_xml) if metadata_xml else [], 'versions': []}
+    sort_keys = {version: try_version_sort_key(version) for version, ebuild, cache_file in versions}
+    # From the lowest version up, with invalid ones first, so that the description of the highest version that has one wins
+    for version, ebuild, cache_file in sorted(versions, key=lambda entry: (sort_keys[entry[0]] is not None, sort_keys[entry[0]] or '', entry[0])):
+        metadata = read_md5_cache(cache_file) if cache_file else read_ebuild_vars(ebuild)
+        if metadata.get('DESCRIPTION'):
+            pkg['description'] = metadata['DESCRIPTION']
+        pkg['versions'].append({'version': version, 'keywords': metadata.get('KEYWORDS', '').split()})
+    return pkg
+
+def local_url(repo, category, name):
+    """HttpCache key under which the fingerprint of a locally synced package is kept.
+
+    The repository path is hashed, so the key fits HttpCache.url however deep the checkout is.
+    """
+    repo_hash = hashlib.sha1(os.path.abspath(repo).encode('utf-8')).hexdigest()[:16]
+    return "file://%s/%s/%s" % (repo_hash, category, name)
+
+@journaled('local', resumable=True)
+def sync_local(repo, *, journal):
+    """Synchronize categories and package details from a local gentoo repository checkout at repo.
+
+    This is an offline alternative to sync_categories, sync_packages and sync_versions:
+    versions, KEYWORDS and descriptions are read from metadata/md5-cache (or the
+    ebuilds themselves, if the cache isn't generated), maintainers from metadata.xml.
+    Packages none of whose files changed since the last run, as told by their mtimes,
+    are skipped; packages without ebuilds left, or without a directory at all, lose
+    their versions.
+
+    Progress is committed after every category and every SYNC_TRANSACTION_SIZE changed
+    packages; a run that was interrupted is resumed by the next one after the last
+    completed category, skipping the packages already committed as unchanged.
+    """
+    start = time.monotonic()
+    now = datetime.utcnow()
+    with journal.phase('prepare'):
+        categories = read_categories(repo)
+        upsert(Category, [{'name': category, 'description': category_description(repo, category)} for category in categories],
+               ['name'], keep_existing=['description'])
+        category_ids = dict(db.session.query(Category.name, Category.id))
+        maintainer_ids = {} # email->id, filled in as maintainers are encountered
+        keyword_ids = dict(db.session.query(Keyword.name, Keyword.id))
+        cache_entries = load_http_cache()
+    if journal.resume_from:
+        categories = [category for category in categories if category > journal.resume_from]
+    updated = unchanged = 0
+    changes = [] # (package, change) of changed packages, applied in bulk before each commit
+    validators = []
+
+    def apply_changes():
+        nonlocal updated
+        with journal.phase('update'):
+            apply_package_changes(changes, maintainer_ids, keyword_ids)
+            remember_many_validators(validators, cache_entries)
+            mark_synced('local')
+        updated += len(changes)
+        changes.clear()
+        validators.clear()
+
+    for category in sorted(categories):
+        cat_dir = os.path.join(repo, category)
+        if not os.path.isdir(cat_dir):
+            print("Category %s has no directory in %s" % (category, repo))
+            continue
+        with journal.phase('scan'):
+            scanned = {}
+            for entry in os.scandir(cat_dir):
+                if entry.is_dir():
+                    result = scan_package(repo, category, entry.name)
+                    if result:
+                        scanned[entry.name] = result
+
+        upsert(Package, [{'category_id': category_ids[category], 'name': name} for name in scanned], ['category_id', 'name'])
+        packages = {package.name: package for package in Package.query.filter_by(category_id=category_ids[category])}
+        for name, (fingerprint, versions, metadata_xml) in sorted(scanned.items()):
+            journal.processed += 1
+            url = local_url(repo, category, name)
+            if cache_entries.get(url) == (None, fingerprint):
+                unchanged += 1
+                continue
+            full_name = "%s/%s" % (category, name)
+            try:
+                with journal.phase('read'):
+                    change = normalize_package(full_name, read_package(versions, metadata_xml))
+            except ValueError as e:
+                print(e)
+                journal.failed += 1
+                continue
+            print("Updating package: %s" % full_name)
+            packages[name].last_sync_ts = now
+            changes.append((packages[name], change))
+            validators.append((url, None, fingerprint))
+            if len(changes) >= SYNC_TRANSACTION_SIZE:
+                apply_changes()
+                journal.checkpoint()
+
+        # Packages without ebuilds left, or whose directory is gone altogether, have no versions anymore
+        with_versions = set(package_id for package_id, in db.session.query(PackageVersion.package_id).join(PackageVersion.package)
+                            .filter(Package.category_id == category_ids[category]).distinct())
+        removed = [package for package in packages.values() if package.name not in scanned and package.id in with_versions]
+        if removed:
+            for package in removed:
+                print("Removing versions of package: %s/%s" % (category, package.name))
+                package.last_sync_ts = now
+            with journal.phase('update'):
+                reconcile_versions({package.id: [] for package in removed}, keyword_ids)
+                remember_many_validators([(local_url(repo, category, package.name), None, None) for package in removed], cache_entries)
+                mark_synced('local')
+            updated += len(removed)
+
+        if changes:
+            apply_changes()
+        # Changed packages are indexed along with their changes; this catches the ones failing to read
+        if index_new_packages(category_ids[category]):
+            mark_synced('local')
+        journal.checkpoint(category)
+
+    # Like in sync_versions, also when only an interrupted run changed packages, and as a new generation
+    if updated or journal.interrupted:
+        with journal.phase('closure'):
+            rebuild_maintainer_closure()
+            mark_synced('local')
+    db.session.commit()
+    elapsed = time.monotonic() - start
+    print("Synced %d packages (%d unchanged) in %.1f seconds" % (updated + unchanged, unchanged, elapsed))
@@ -1,4 +1,9 @@
+import json
 from datetime import datetime
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import aliased
+
 from .. import db
 
 
@@ -14,6 +19,19 @@ class Keyword(db.Model):
     def __repr__(self):
         return "<Keyword %r>" % self.name
 
+class Arch(db.Model):
+    """Position of an architecture in the PackageVersion keyword bitmasks; assigned on first sight and never reused"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.Unicode(20), unique=True, nullable=False) # keyword without "~", e.g. "amd64" or "x64-macos"
+    bit = db.Column(db.Integer, unique=True, nullable=False)
+
+    @property
+    def mask(self):
+        return 1 << self.bit
+
+    def __repr__(self):
+        return "<Arch %r %d>" % (self.name, self.bit)
+
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.Unicode(30), unique=True, nullable=False)
@@ -22,18 +40,25 @@ class Category(db.Model):
     def __repr__(self):
         return "<Category %r>" % self.name
 
+# Uniqueness is enforced via unique indexes instead of constraints throughout, as SQLite can't add constraints to existing tables, but can add indexes (see "manage.py upgrade")
 package_maintainer_rel_table = db.Table('package_maintainer_rel',
     db.Column('package_id', db.Integer, db.ForeignKey('package.id')),
     db.Column('maintainer_id', db.Integer, db.ForeignKey('maintainer.id')),
+    db.Index('ix_package_maintainer_rel_package_id_maintainer_id', 'package_id', 'maintainer_id', unique=True),
+    db.Index('ix_package_maintainer_rel_maintainer_id', 'maintainer_id'),
 )
 
 class Package(db.Model):
+    __table_args__ = (
+        db.Index('ix_package_category_id_name', 'category_id', 'name', unique=True),
+        db.Index('ix_package_name', 'name'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.Unicode(128), nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
     category = db.relationship('Category', backref=db.backref('packages', lazy='select'))
     description = db.Column(db.Unicode(500))
-    last_sync_ts = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcfromtimestamp(0))
+    last_sync_ts = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcfromtimestamp(0), index=True)
     maintainers = db.relationship("Maintainer",
         secondary=package_maintainer_rel_table,
         backref='directly_maintained_packages')
@@ -49,15 +74,39 @@ class Package(db.Model):
 package_version_keywords_rel_table = db.Table('package_version_keywords_rel',
     db.Column('package_version_id', db.Integer, db.ForeignKey('package_version.id')),
     db.Column('keyword_id', db.Integer, db.ForeignKey('keyword.id')),
+    db.Index('ix_package_version_keywords_rel_package_version_id_keyword_id', 'package_version_id', 'keyword_id', unique=True),
+    db.Index('ix_package_version_keywords_rel_keyword_id', 'keyword_id'),
 )
 
 class PackageVersion(db.Model):
+    __table_args__ = (
+        db.Index('ix_package_version_package_id_version', 'package_id', 'version', unique=True),
+        db.Index('ix_package_version_package_id_sort_key', 'package_id', 'sort_key'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     version = db.Column(db.Unicode(128), nullable=False)
+    # versions.version_sort_key of version, ordering like PMS version comparison; NULL for invalid versions or until computed.
+    # Needs byte order comparison, which PostgreSQL only does with the C collation
+    sort_key = db.Column(db.Unicode(400).with_variant(postgresql.VARCHAR(400, collation='C'), 'postgresql'), nullable=True)
     package_id = db.Column(db.Integer, db.ForeignKey('package.id'), nullable=False)
-    package = db.relationship('Package', backref=db.backref('versions', lazy='select'))
+    package = db.relationship('Package', backref=db.backref('versions', lazy='select', order_by=lambda: PackageVersion.sort_key.asc().nullsfirst()))
     keywords = db.relationship("Keyword", secondary=package_version_keywords_rel_table)
     masks = db.Column(db.UnicodeText, nullable=True) # Concatenated mask reasons if p.masked, NULL if not a masked version. TODO: arch specific masks
+    # Derived from keywords by the syncs for cross-package reports: bitmasks over Arch.bit of the arches the version is stable on,
+    # and of the ones it is only ~arch keyworded on; NULL until computed (see sync.rebuild_arch_masks)
+    stable_arches = db.Column(db.BigInteger, nullable=True)
+    testing_arches = db.Column(db.BigInteger, nullable=True)
+
+    @classmethod
+    def newest(cls, package_ids, stable_on=None):
+        """Return a package id -> version dict of the highest version of each of package_ids, optionally only among
+        the ones stable on the Arch stable_on; found through the (package_id, sort_key) index"""
+        other = aliased(cls)
+        highest = db.session.query(db.func.max(other.sort_key)).filter(other.package_id == cls.package_id)
+        if stable_on is not None:
+            highest = highest.filter(other.stable_arches.op('&')(stable_on.mask) != 0)
+        return dict(db.session.query(cls.package_id, cls.version)
+                    .filter(cls.package_id.in_(package_ids), cls.sort_key == highest.scalar_subquery()))
 
     def __repr__(self):
         return "<PackageVersion '%s/%s-%s'>" % (self.package.category.name, self.package.name, self.version)
@@ -65,7 +114,10 @@ class PackageVersion(db.Model):
 
 maintainer_project_membership_rel_table = db.Table('maintainer_project_membership_rel',
     db.Column('project_id', db.Integer, db.ForeignKey('maintainer.id')),
-    db.Column('maintainer_id', db.Integer, db.ForeignKey('maintainer.id')),
+    db.Column('maintainer_id', db.Integer, db.ForeignKey('maintainer.id')), # member or subproject
+    db.Column('inherit_members', db.Boolean, nullable=False, server_default=db.false(), default=False), # for subprojects: whether their members count as members of project_id too
+    db.Index('ix_maintainer_project_membership_rel_project_id_maintainer_id', 'project_id', 'maintainer_id', unique=True),
+    db.Index('ix_maintainer_project_membership_rel_maintainer_id', 'maintainer_id'),
 )
 
 class Maintainer(db.Model):
@@ -88,16 +140,128 @@ class Maintainer(db.Model):
     def __repr__(self):
         return "<Maintainer %s '%s'>" % ("project" if self.is_project else "individual", self.email)
 
+# Materialized closures of project membership and maintainership, rebuilt by the syncs (see sync.rebuild_maintainer_closure)
+project_member_closure_table = db.Table('project_member_closure',
+    db.Column('project_id', db.Integer, db.ForeignKey('maintainer.id'), primary_key=True),
+    db.Column('maintainer_id', db.Integer, db.ForeignKey('maintainer.id'), primary_key=True),
+    db.Column('depth', db.Integer, nullable=False), # 1 for direct members, +1 per inherit-members subproject in between
+    db.Column('path', db.UnicodeText, nullable=False), # space separated project emails from the maintainer's own project up to project_id
+)
+
+# Effective maintainer of every package: directly, or as (inherited) member of a project maintaining it, preferring the shortest path
+maintainer_package_closure_table = db.Table('maintainer_package_closure',
+    db.Column('maintainer_id', db.Integer, db.ForeignKey('maintainer.id'), primary_key=True),
+    db.Column('package_id', db.Integer, db.ForeignKey('package.id'), primary_key=True),
+    db.Column('via_project_id', db.Integer, db.ForeignKey('maintainer.id'), nullable=True), # NULL if maintained directly
+    db.Column('via_path', db.UnicodeText, nullable=True), # project_member_closure.path to via_project_id
+    db.Index('ix_maintainer_package_closure_package_id', 'package_id'),
+)
+
+# Full-text search index of packages (see search.py), one row per package with the terms of the full name, description
+# and maintainers, so that name matches can rank first. It's kept outside the ORM metadata, as neither an FTS5 virtual table
+# nor a tsvector with a GIN index can be declared portably, but is created and dropped along with the other tables.
+db.event.listen(db.metadata, 'after_create', db.DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS package_search USING fts5(name, description, maintainers, prefix='1 2 3')"
+).execute_if(dialect='sqlite'))
+db.event.listen(db.metadata, 'after_create', db.DDL(
+    "CREATE TABLE IF NOT EXISTS package_search (package_id integer PRIMARY KEY REFERENCES package(id), document tsvector NOT NULL)"
+).execute_if(dialect='postgresql'))
+db.event.listen(db.metadata, 'after_create', db.DDL(
+    "CREATE INDEX IF NOT EXISTS ix_package_search_document ON package_search USING gin(document)"
+).execute_if(dialect='postgresql'))
+db.event.listen(db.metadata, 'before_drop', db.DDL("DROP TABLE IF EXISTS package_search"))
+
 class PkgCheck(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True, index=True)
     category = db.relationship('Category', backref=db.backref('pkgcheck_violations', lazy='select'))
-    package_id = db.Column(db.Integer, db.ForeignKey('package.id'), nullable=True)
+    package_id = db.Column(db.Integer, db.ForeignKey('package.id'), nullable=True, index=True)
     package = db.relationship('Package', backref=db.backref('pkgcheck_violations', lazy='select'))
-    version_id = db.Column(db.Integer, db.ForeignKey('package_version.id'), nullable=True)
+    version_id = db.Column(db.Integer, db.ForeignKey('package_version.id'), nullable=True, index=True)
     version = db.relationship('PackageVersion', backref=db.backref('pkgcheck_violations', lazy='select'))
     violationclass = db.Column(db.Unicode(30), nullable=False)
-    message = db.Column(db.Unicode(128), nullable=False)
+    message = db.Column(db.UnicodeText, nullable=False) # Unbounded, as unlike SQLite, PostgreSQL enforces length limits
 
     def __repr__(self):
         return "<PkgCheck %s/%s-%s %s>" % (self.category.name, self.package.name, self.violationclass)
+
+# New results of a running sync_pkgcheck, collected in committed batches and moved to pkg_check in its last transaction
+pkg_check_staging_table = db.Table('pkg_check_staging',
+    db.Column('category_id', db.Integer, nullable=True),
+    db.Column('package_id', db.Integer, nullable=True),
+    db.Column('version_id', db.Integer, nullable=True),
+    db.Column('violationclass', db.Unicode(30), nullable=False),
+    db.Column('message', db.UnicodeText, nullable=False),
+)
+
+follower_maintainer_rel_table = db.Table('follower_maintainer_rel',
+    db.Column('follower_id', db.Integer, db.ForeignKey('follower.id')),
+    db.Column('maintainer_id', db.Integer, db.ForeignKey('maintainer.id')),
+    db.Index('ix_follower_maintainer_rel_follower_id_maintainer_id', 'follower_id', 'maintainer_id', unique=True),
+    db.Index('ix_follower_maintainer_rel_maintainer_id', 'maintainer_id'),
+)
+
+class Follower(db.Model):
+    """Followed maintainers of a site visitor, identified by a random token kept in their session"""
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.Unicode(64), unique=True, nullable=False)
+    created_ts = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcnow)
+    updated_ts = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcnow) # last change or (at most daily updated) use of the follows
+    maintainers = db.relationship("Maintainer", secondary=follower_maintainer_rel_table)
+
+    @classmethod
+    def prune(cls, before):
+        """Delete the followers not updated since before, along with their follows; returns how many"""
+        stale = db.select(cls.id).where(cls.updated_ts < before)
+        db.session.execute(follower_maintainer_rel_table.delete().where(follower_maintainer_rel_table.c.follower_id.in_(stale)))
+        return cls.query.filter(cls.updated_ts < before).delete(synchronize_session=False)
+
+    def __repr__(self):
+        return "<Follower %d>" % self.id
+
+class HttpCache(db.Model):
+    """Validators of the last successfully synced response per source URL, used for conditional requests"""
+    url = db.Column(db.Unicode(255), primary_key=True)
+    etag = db.Column(db.Unicode(128), nullable=True)
+    last_modified = db.Column(db.Unicode(64), nullable=True) # Verbatim HTTP-date as sent by the server
+
+    @property
+    def validators(self):
+        return (self.etag, self.last_modified)
+
+    def __repr__(self):
+        return "<HttpCache %r>" % self.url
+
+class SyncState(db.Model):
+    """Time of the last data change per sync source, used to version everything derived from the DB"""
+    source = db.Column(db.Unicode(30), primary_key=True)
+    updated_ts = db.Column(db.TIMESTAMP, nullable=False)
+
+    @classmethod
+    def last_change(cls):
+        """UTC time of the most recent data change from any source, or None before the first sync"""
+        return db.session.query(db.func.max(cls.updated_ts)).scalar()
+
+    def __repr__(self):
+        return "<SyncState %s %s>" % (self.source, self.updated_ts)
+
+class SyncRun(db.Model):
+    """Journal entry of one sync command run, for progress monitoring and resuming"""
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.Unicode(30), nullable=False, index=True)
+    status = db.Column(db.Unicode(10), nullable=False) # running, finished or failed; a crashed run stays "running"
+    started_ts = db.Column(db.TIMESTAMP, nullable=False)
+    updated_ts = db.Column(db.TIMESTAMP, nullable=False) # last checkpoint
+    finished_ts = db.Column(db.TIMESTAMP, nullable=True)
+    checkpoint = db.Column(db.Unicode(255), nullable=True) # source specific key of the last committed item
+    items_processed = db.Column(db.Integer, nullable=False, default=0)
+    items_failed = db.Column(db.Integer, nullable=False, default=0)
+    bytes_downloaded = db.Column(db.BigInteger, nullable=False, default=0)
+    phase_durations = db.Column(db.UnicodeText, nullable=True) # JSON object of phase name -> seconds
+
+    @property
+    def phases(self):
+        return json.loads(self.phase_durations) if self.phase_durations else {}
+
+    def __repr__(self):
+        return "<SyncRun %d %s %s>" % (self.id, self.source, self.status)
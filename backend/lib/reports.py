@@ -0,0 +1,82 @@
+from .. import db
+from .models import Arch, Category, Package, PackageVersion
+
+
+def mask_bits(mask):
+    """Yield the positions of the bits set in mask"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def keyword_report(reference='amd64', arch=None):
+    """Compute the arch lag behind reference and the stabilization candidates of every arch in a single scan.
+
+    Both are derived from the PackageVersion keyword bitmasks, ignoring p.masked versions:
+    arch_lag lists the versions stable on the reference arch but only ~arch keyworded on an
+    arch, stabilization_candidates the versions only ~arch keyworded on an arch that an older
+    version of the same package is already stable on, while no newer one is. Entries are
+    "category/package-version" strings, by package name and then version. With arch given,
+    only that arch is reported.
+
+    Returns a dict, or None if reference or arch is not a known arch.
+    """
+    arch_names = dict(db.session.query(Arch.bit, Arch.name))
+    arch_bits = {name: bit for bit, name in arch_names.items()}
+    if reference not in arch_bits or (arch is not None and arch not in arch_bits):
+        return None
+    reference_mask = 1 << arch_bits[reference]
+    wanted = 1 << arch_bits[arch] if arch else (1 << max(arch_bits.values()) + 1) - 1
+    report = {name: {'arch_lag': [], 'stabilization_candidates': []} for name in sorted(arch_bits) if 1 << arch_bits[name] & wanted}
+
+    rows = db.session.query(Category.name, Package.name, PackageVersion.version, PackageVersion.stable_arches, PackageVersion.testing_arches) \
+        .join(Package.category).join(PackageVersion, PackageVersion.package_id == Package.id) \
+        .filter(PackageVersion.masks == None) \
+        .order_by(Category.name, Package.name, PackageVersion.sort_key.asc().nullsfirst(), PackageVersion.version)
+
+    def flush(versions, package_stable):
+        newer_stable = 0 # arches any of the versions newer than the current one are stable on
+        candidates = []
+        for cpv, stable, testing in reversed(versions):
+            candidates.append((cpv, testing & package_stable & ~newer_stable))
+            newer_stable |= stable
+        for cpv, candidate_arches in reversed(candidates):
+            for bit in mask_bits(candidate_arches & wanted):
+                report[arch_names[bit]]['stabilization_candidates'].append(cpv)
+        for cpv, stable, testing in versions:
+            if stable & reference_mask:
+                for bit in mask_bits(testing & wanted):
+                    report[arch_names[bit]]['arch_lag'].append(cpv)
+
+    # Rows come grouped by package and ordered by version (invalid ones first);
+    # candidates need the stable arches of all versions of the package first
+    current = None
+    versions = []
+    package_stable = 0
+    for category, name, version, stable, testing in rows:
+        if (category, name) != current:
+            flush(versions, package_stable)
+            current = (category, name)
+            versions = []
+            package_stable = 0
+        stable = stable or 0
+        package_stable |= stable
+        versions.append(("%s/%s-%s" % (category, name, version), stable, testing or 0))
+    flush(versions, package_stable)
+    return {'reference': reference, 'arches': report}
+
+def print_keyword_report(reference='amd64', arch=None):
+    """Print the keyword_report counts per arch, and with arch given, the versions themselves; returns 1 for unknown arches"""
+    report = keyword_report(reference, arch)
+    if report is None:
+        print("Unknown arch %s" % (arch if reference in dict(db.session.query(Arch.name, Arch.id)) else reference))
+        return 1
+    for name, entries in report['arches'].items():
+        print("%s: %d versions stable on %s only ~%s, %d stabilization candidates" % (
+            name, len(entries['arch_lag']), reference, name, len(entries['stabilization_candidates'])))
+        if arch:
+            for title, key in (("Behind %s" % reference, 'arch_lag'), ("Stabilization candidates", 'stabilization_candidates')):
+                print("  %s:" % title)
+                for cpv in entries[key]:
+                    print("    %s" % cpv)
+    return 0
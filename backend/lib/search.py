@@ -0,0 +1,113 @@
+import re
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import contains_eager
+
+from .. import db
+from .models import Category, Maintainer, Package, package_maintainer_rel_table
+
+SEARCH_BATCH_SIZE = 500 # packages per refresh round trip
+SEARCH_LIMIT = 50 # default number of results
+SEARCH_RANK_MAX_MATCHES = 2000 # matches up to which results are ranked by relevance
+
+
+def search_terms(text):
+    """Lower cased alphanumeric words of text, the same way for documents and queries of all databases"""
+    return re.findall(r'[^\W_]+', text.lower()) if text else []
+
+def package_documents(package_ids):
+    """Yield (package id, name terms, description terms, maintainer terms) for package_ids"""
+    maintainers = {}
+    rel = package_maintainer_rel_table
+    for package_id, email, name in db.session.query(rel.c.package_id, Maintainer.email, Maintainer.name) \
+            .join(Maintainer, Maintainer.id == rel.c.maintainer_id).filter(rel.c.package_id.in_(package_ids)):
+        maintainers.setdefault(package_id, []).extend(search_terms(email) + search_terms(name))
+    for package_id, category, name, description in db.session.query(Package.id, Category.name, Package.name, Package.description) \
+            .join(Package.category).filter(Package.id.in_(package_ids)):
+        yield (package_id, " ".join(search_terms(category) + search_terms(name)), " ".join(search_terms(description)),
+               " ".join(maintainers.get(package_id, [])))
+
+def refresh_search_index(package_ids):
+    """Update the search index entries of package_ids from the current package data; part of the current transaction"""
+    package_ids = list(package_ids)
+    for i in range(0, len(package_ids), SEARCH_BATCH_SIZE):
+        batch = package_ids[i:i + SEARCH_BATCH_SIZE]
+        if db.engine.name == 'sqlite':
+            db.session.execute(text("DELETE FROM package_search WHERE rowid IN :ids").bindparams(bindparam('ids', expanding=True)), {'ids': batch})
+            insert = "INSERT INTO package_search (rowid, name, description, maintainers) VALUES (:id, :name, :description, :maintainers)"
+        else:
+            db.session.execute(text("DELETE FROM package_search WHERE package_id IN :ids").bindparams(bindparam('ids', expanding=True)), {'ids': batch})
+            insert = ("INSERT INTO package_search (package_id, document) VALUES (:id, "
+                      "setweight(to_tsvector('simple', :name), 'A') || setweight(to_tsvector('simple', :maintainers), 'B') || "
+                      "setweight(to_tsvector('simple', :description), 'C'))")
+        rows = [{'id': package_id, 'name': name, 'description': description, 'maintainers': maintainers}
+                for package_id, name, description, maintainers in package_documents(batch)]
+        if rows:
+            db.session.execute(text(insert), rows)
+
+def index_new_packages(category_id=None):
+    """Add the packages (of category_id, if given) that aren't in the search index yet, e.g. just added by sync_packages"""
+    key = 'rowid' if db.engine.name == 'sqlite' else 'package_id'
+    query = "SELECT id FROM package WHERE id NOT IN (SELECT %s FROM package_search)" % key
+    if category_id is not None:
+        query += " AND category_id = :category_id"
+    missing = [package_id for package_id, in db.session.execute(text(query), {'category_id': category_id})]
+    refresh_search_index(missing)
+    return len(missing)
+
+def rebuild_search_index():
+    """Recreate the search index entries of all packages"""
+    db.session.execute(text("DELETE FROM package_search"))
+    count = index_new_packages()
+    print("Indexed %d packages for search" % count)
+
+def search_packages(query, limit=SEARCH_LIMIT):
+    """Return up to limit Packages matching all words of query, each of which may also be a prefix, best matches first.
+
+    Packages whose name has all the words as such come first, then the rest by relevance.
+    Ranking by relevance has to look at every match, so it is only done for up to
+    SEARCH_RANK_MAX_MATCHES of them; broader queries, typically short prefixes typed on the
+    way to a longer one, instead get the first packages matching in their name and then
+    in any field, each by name.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    if db.engine.name == 'sqlite':
+        # Quoted, so that words like AND or NEAR aren't taken for operators
+        match = " AND ".join('"%s"*' % term for term in terms)
+        name_match = "{name} : (%s)" % match
+        exact_match = "{name} : (%s)" % " AND ".join('"%s"' % term for term in terms)
+        count = "SELECT count(*) FROM (SELECT 1 FROM package_search WHERE package_search MATCH :match LIMIT :limit)"
+        # bm25 weights of the name, description and maintainers columns
+        ranked = ("SELECT rowid FROM package_search WHERE package_search MATCH :match "
+                  "ORDER BY rowid IN (SELECT rowid FROM package_search WHERE package_search MATCH :exact_match) DESC, "
+                  "bm25(package_search, 10.0, 1.0, 2.0) LIMIT :limit")
+        unranked = "SELECT rowid FROM package_search WHERE package_search MATCH :match LIMIT :limit"
+    else:
+        match = " & ".join("%s:*" % term for term in terms)
+        name_match = " & ".join("%s:*A" % term for term in terms) # weight A: name terms
+        exact_match = " & ".join("%s:A" % term for term in terms)
+        count = "SELECT count(*) FROM (SELECT 1 FROM package_search WHERE document @@ to_tsquery('simple', :match) LIMIT :limit) AS matches"
+        ranked = ("SELECT package_id FROM package_search WHERE document @@ to_tsquery('simple', :match) "
+                  "ORDER BY document @@ to_tsquery('simple', :exact_match) DESC, ts_rank(document, to_tsquery('simple', :match)) DESC LIMIT :limit")
+        unranked = "SELECT package_id FROM package_search WHERE document @@ to_tsquery('simple', :match) LIMIT :limit"
+
+    def package_ids(statement, match, limit):
+        return [package_id for package_id, in db.session.execute(text(statement), {'match': match, 'exact_match': exact_match, 'limit': limit})]
+
+    if db.session.execute(text(count), {'match': match, 'limit': SEARCH_RANK_MAX_MATCHES + 1}).scalar() <= SEARCH_RANK_MAX_MATCHES:
+        tiers = [package_ids(ranked, match, limit)]
+    else:
+        tiers = []
+        seen = set()
+        for tier_match in (exact_match, name_match, match):
+            ids = [id for id in package_ids(unranked, tier_match, limit) if id not in seen][:limit - len(seen)]
+            seen.update(ids)
+            tiers.append(ids)
+    packages = {package.id: package for package in Package.query.filter(Package.id.in_([id for ids in tiers for id in ids]))
+                .join(Package.category).options(contains_eager(Package.category))}
+    if len(tiers) == 1:
+        return [packages[id] for id in tiers[0] if id in packages]
+    return [package for ids in tiers
+            for package in sorted((packages[id] for id in ids if id in packages), key=lambda package: (package.category.name, package.name))]
@@ -1,30 +1,349 @@
+import multiprocessing
+import threading
 import time
 import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import urlsplit
 
 import requests
+from sqlalchemy import Integer, and_, bindparam, cast, func, literal, null, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
 
 from .. import app, db
-from .models import Category, Keyword, Maintainer, Package, PackageVersion, PkgCheck
+from .journal import SyncFailed, journaled
+from .models import Arch, Category, HttpCache, Keyword, Maintainer, Package, PackageVersion, PkgCheck, SyncState, \
+    maintainer_package_closure_table, maintainer_project_membership_rel_table, package_maintainer_rel_table, \
+    package_version_keywords_rel_table, pkg_check_staging_table, project_member_closure_table
+from .search import index_new_packages, refresh_search_index
+from .versions import try_version_sort_key
 
 SYNC_BUFFER_SECS = 60*60 #1 hour
+SYNC_FETCH_JOBS = 8 # concurrent package JSON downloads (threads) in sync_versions
+SYNC_RATE_LIMIT = 20 # max requests per second per host during concurrent fetching; 0 disables throttling
+PKGCHECK_BATCH_SIZE = 5000 # rows per bulk INSERT in sync_pkgcheck, each committed on its own
+SYNC_TRANSACTION_SIZE = 100 # packages per committed transaction: all fetched ones (changed, unchanged or failed) in sync_versions, changed ones in sync_local
+UPSERT_BATCH_SIZE = 500 # rows per INSERT ... ON CONFLICT statement, and keys per IN (...) lookup
+MAX_ARCH_BITS = 63 # PackageVersion.stable_arches/testing_arches are signed 64-bit
 proj_url = "https://api.gentoo.org/metastructure/projects.xml"
 pkg_url_base = "https://packages.gentoo.org/"
+pkgcheck_url = "https://gitweb.gentoo.org/report/gentoo-ci.git/plain/output.xml"
 http_session = requests.session()
+_thread_local = threading.local()
 
 
-def get_project_data():
+def get_http_session():
+    """Return a requests session private to the calling thread.
+
+    requests.Session isn't guaranteed to be thread-safe, so every fetch worker
+    thread gets its own session (and with that its own keep-alive pool).
+    """
+    session = getattr(_thread_local, 'http_session', None)
+    if session is None:
+        session = requests.session()
+        _thread_local.http_session = session
+    return session
+
+def conditional_get(url, validators=None, session=None, **kwargs):
+    """GET url, asking the server to answer with 304 Not Modified if it still matches validators.
+
+    validators is an (etag, last_modified) tuple as stored in HttpCache, or None for an
+    unconditional request.
+    """
+    headers = kwargs.pop('headers', {})
+    if validators:
+        etag, last_modified = validators
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+    return (session or http_session).get(url, headers=headers, **kwargs)
+
+def not_modified(response):
+    return response is not None and response.status_code == 304
+
+def batches(items, size=UPSERT_BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def dialect_insert(table):
+    """Return an INSERT construct for table that supports on_conflict_do_update() on the DB in use"""
+    if db.engine.name == 'postgresql':
+        return postgresql.insert(table)
+    elif db.engine.name == 'sqlite':
+        return sqlite.insert(table)
+    raise NotImplementedError("Database backend %s isn't supported, use PostgreSQL or SQLite" % db.engine.name)
+
+def upsert(model, rows, index_elements, update=(), keep_existing=()):
+    """Insert row dicts into the table of model in batches, with INSERT ... ON CONFLICT.
+
+    Rows conflicting with an existing one on the unique index over index_elements have
+    their `update` columns overwritten, and their keep_existing columns overwritten only
+    with non-NULL values; without either, existing rows are left alone. All rows must
+    have the same keys.
+    """
+    if not rows:
+        return
+    table = getattr(model, '__table__', model)
+    # One statement can't insert and then update the same row, so rows with the same key are merged first
+    merged = {}
+    for row in rows:
+        key = tuple(row[col] for col in index_elements)
+        if key in merged:
+            row = dict(row, **{col: merged[key][col] for col in keep_existing if row[col] is None})
+        merged[key] = row
+    rows = list(merged.values())
+    stmt = dialect_insert(table)
+    set_ = {col: stmt.excluded[col] for col in update}
+    set_.update({col: func.coalesce(stmt.excluded[col], table.c[col]) for col in keep_existing})
+    if set_:
+        stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=set_)
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    for batch in batches(rows):
+        db.session.execute(stmt, batch)
+
+def lookup_ids(model, key_column, keys):
+    """Return a key->id dict of the rows of model whose key_column value is in keys"""
+    ids = {}
+    for batch in batches(set(keys)):
+        ids.update(db.session.query(key_column, model.id).filter(key_column.in_(batch)))
+    return ids
+
+def replace_links(table, columns, owner_ids, wanted):
+    """Make the rows of association table for owner_ids be exactly the wanted set of tuples.
+
+    columns are the table columns the tuples consist of, the first one being the owner
+    id column. The stored tuples are diffed against wanted, so only the changed rows get
+    deleted or inserted, in bulk.
+    """
+    owner_column = columns[0]
+    stored = set()
+    for batch in batches(owner_ids):
+        stored.update(tuple(row) for row in db.session.query(*columns).filter(owner_column.in_(batch)))
+    to_add = wanted - stored
+    to_remove = stored - wanted
+    # Delete first, as a changed row is a removal and an addition of the same unique key
+    if to_remove:
+        db.session.execute(table.delete().where(and_(*(column == bindparam('old_%s' % column.name) for column in columns))),
+                           [{'old_%s' % column.name: value for column, value in zip(columns, row)} for row in to_remove])
+    if to_add:
+        db.session.execute(table.insert(), [{column.name: value for column, value in zip(columns, row)} for row in to_add])
+
+def load_http_cache():
+    """Return all stored HttpCache validators as an url->(etag, last_modified) dict"""
+    return {url: (etag, last_modified) for url, etag, last_modified in db.session.query(HttpCache.url, HttpCache.etag, HttpCache.last_modified)}
+
+def get_validators(url, cache_entries=None):
+    if cache_entries is not None:
+        return cache_entries.get(url)
+    entry = db.session.query(HttpCache.etag, HttpCache.last_modified).filter_by(url=url).first()
+    return tuple(entry) if entry else None
+
+def remember_response(url, response, cache_entries=None):
+    """Record the validators of a successfully processed response for url.
+
+    This is part of the open DB transaction, so the validators get persisted by the same
+    commit as the data derived from the response - an aborted sync never leaves behind
+    validators for data we don't have.
+    """
+    remember_validators(url, response.headers.get('ETag'), response.headers.get('Last-Modified'), cache_entries)
+
+def remember_validators(url, etag, last_modified, cache_entries=None):
+    """Like remember_response, for validators already taken from the response (e.g. in a worker process)"""
+    remember_many_validators([(url, etag, last_modified)], cache_entries)
+
+def remember_many_validators(validators, cache_entries=None):
+    """Like remember_validators, for a list of (url, etag, last_modified) tuples at once"""
+    gone = [url for url, etag, last_modified in validators if not etag and not last_modified]
+    for batch in batches(gone):
+        db.session.execute(HttpCache.__table__.delete().where(HttpCache.url.in_(batch)))
+    upsert(HttpCache, [{'url': url, 'etag': etag, 'last_modified': last_modified} for url, etag, last_modified in validators if etag or last_modified],
+           ['url'], update=['etag', 'last_modified'])
+    if cache_entries is not None:
+        for url, etag, last_modified in validators:
+            if etag or last_modified:
+                cache_entries[url] = (etag, last_modified)
+            else:
+                cache_entries.pop(url, None)
+
+def mark_synced(source):
+    """Record that data from source changed, as part of the current DB transaction"""
+    state = SyncState.query.get(source)
+    if not state:
+        state = SyncState(source=source)
+        db.session.add(state)
+    state.updated_ts = datetime.utcnow()
+
+class RateLimiter(object):
+    """Thread-safe throttle spacing requests to the same host at least 1/rate seconds apart"""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def package_json_url(full_name):
+    return pkg_url_base + "packages/" + full_name + ".json"
+
+def response_change(response):
+    """Return the base change set describing a download: its status, validators and size.
+
+    Change sets are plain dicts, so they can be produced by fetch workers - including
+    other processes - and applied by the single DB writer. status is 'ok',
+    'not_modified' or 'failed'.
+    """
+    if response is None:
+        return {'status': 'failed', 'etag': None, 'last_modified': None, 'bytes': 0}
+    return {
+        'status': 'not_modified' if not_modified(response) else 'ok' if response else 'failed',
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'bytes': response.raw.tell() if hasattr(response.raw, 'tell') else 0,
+    }
+
+def normalize_package(full_name, pkg):
+    """Reduce package JSON to the change set fields sync_versions applies, validating it on the way"""
+    change = {
+        'maintainers': [],
+        'versions': [{'version': version['version'], 'keywords': version['keywords']} for version in pkg['versions']],
+    }
+    if 'description' in pkg:
+        change['description'] = pkg['description']
+    for maint in pkg.get('maintainers', []):
+        if 'email' not in maint or 'type' not in maint:
+            raise ValueError(
+                "Package %s maintainer %s entry not GLEP 67 valid" %
+                (full_name, maint)
+            )
+        change['maintainers'].append((maint['email'].lower(), maint['type'] == 'project', maint.get('name')))
+    return change
+
+def fetch_package_change(full_name, url, validators, limiter):
+    """Download a package JSON and return its normalized change set.
+
+    Runs in fetch worker threads (and processes), so must not touch the DB session.
+    """
+    limiter.wait(url)
+    try:
+        data = conditional_get(url, validators, session=get_http_session())
+    except requests.RequestException as e:
+        print("Failed retrieving %s: %s" % (url, e))
+        data = None
+    change = response_change(data)
+    if change['status'] == 'ok':
+        change.update(normalize_package(full_name, data.json()))
+    return change
+
+def fetch_packages(packages, cache_entries, jobs=SYNC_FETCH_JOBS, rate_limit=SYNC_RATE_LIMIT):
+    """Yield (package, change) for each package, downloading up to `jobs` of them concurrently in threads.
+
+    Results are yielded in the order of `packages`, in the calling thread, so the consumer
+    can keep being the single DB writer. At most 2*jobs downloads are queued ahead of
+    the consumer to keep memory bounded.
+    """
+    limiter = RateLimiter(rate_limit)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for package in packages:
+            url = package_json_url(package.full_name)
+            # Validators are looked up here, as the worker threads mustn't touch ORM objects
+            pending.append((package, executor.submit(fetch_package_change, package.full_name, url, get_validators(url, cache_entries), limiter)))
+            if len(pending) >= 2 * jobs:
+                package, future = pending.popleft()
+                yield package, future.result()
+        while pending:
+            package, future = pending.popleft()
+            yield package, future.result()
+
+def fetch_package_shard(job):
+    """Process pool task: download and normalize the packages of one category shard"""
+    shard, jobs, rate_limit = job
+    limiter = RateLimiter(rate_limit)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [(package_id, executor.submit(fetch_package_change, full_name, url, validators, limiter))
+                   for package_id, full_name, url, validators in shard]
+        return [(package_id, future.result()) for package_id, future in futures]
+
+def fetch_packages_sharded(packages, cache_entries, workers, jobs=SYNC_FETCH_JOBS, rate_limit=SYNC_RATE_LIMIT):
+    """Yield (package, change) like fetch_packages, with the work sharded by category over `workers` processes.
+
+    JSON decoding and normalization happen in the worker processes, each of which
+    downloads with `jobs` threads; rate_limit is split evenly between them.
+    """
+    packages_by_id = {}
+    shards = {}
+    for package in packages:
+        url = package_json_url(package.full_name)
+        packages_by_id[package.id] = package
+        shards.setdefault(package.category_id, []).append((package.id, package.full_name, url, get_validators(url, cache_entries)))
+    shard_jobs = [(shard, jobs, rate_limit / workers if rate_limit else 0) for shard in shards.values()]
+    with multiprocessing.Pool(workers) as pool:
+        for results in pool.imap(fetch_package_shard, shard_jobs):
+            for package_id, change in results:
+                yield packages_by_id[package_id], change
+
+def fetch_category_change(job):
+    """Download a category JSON and return its change set with the list of package names; also a process pool task"""
+    url, validators = job
+    try:
+        data = conditional_get(url, validators, session=get_http_session())
+    except requests.RequestException as e:
+        print("Failed retrieving %s: %s" % (url, e))
+        data = None
+    change = response_change(data)
+    if change['status'] == 'ok':
+        change['packages'] = [package['name'] for package in data.json()['packages']]
+    return change
+
+def iterparse_children(data):
+    """Incrementally parse the XML body of a streamed response, returning (root, children).
+
+    root is the document element, available as soon as its start tag is parsed. children
+    iterates over its direct child elements as each one is complete, clearing them from
+    root afterwards, so memory use is bounded by the largest child instead of the whole
+    document (and the raw body is never held in memory in full either).
+    """
+    data.raw.decode_content = True # Transparently undo Content-Encoding: gzip
+    events = ET.iterparse(data.raw, events=('start', 'end'))
+    event, root = next(events)
+
+    def children():
+        depth = 0
+        for event, elem in events:
+            if event == 'start':
+                depth += 1
+                continue
+            if depth == 1:
+                yield elem
+                root.clear()
+            depth -= 1
+        data.close()
+
+    return root, children()
+
+def get_project_data(data):
+    """Parse projects.xml from the given streamed response; raises SyncFailed if there is none"""
     projects = {}
-    data = http_session.get(proj_url)
     if not data:
-        print("Failed retrieving projects.xml")
-        return projects
-    root = ET.fromstring(data.content)
+        raise SyncFailed("Failed retrieving projects.xml")
+    root, proj_elems = iterparse_children(data)
     # Parsing is based on http://www.gentoo.org/dtd/projects.dtd as of 2016-11-10
     if root.tag.lower() != 'projects':
-        print("Downloaded projects.xml root tag isn't 'projects'")
-        return projects
-    for proj_elem in root:
+        raise SyncFailed("Downloaded projects.xml root tag isn't 'projects'")
+    for proj_elem in proj_elems:
         if proj_elem.tag.lower() != 'project':
             print("Skipping unknown <projects> subtag <%s>" % proj_elem.tag)
             continue
@@ -65,254 +384,541 @@ def get_project_data():
             print("Skipping incomplete project data due to lack of required email identifier: %s" % (proj,))
     return projects
 
-def sync_projects():
-    projects = get_project_data()
-    existing_maintainers = {}
-    # TODO: Use UPSERT instead (on_conflict_do_update) if we can rely on postgresql:9.5
-    for maintainer in Maintainer.query.all():
-        existing_maintainers[maintainer.email] = maintainer
-    for email, data in projects.items():
-        if email in existing_maintainers:
-            print ("Updating project %s" % email)
-            existing_maintainers[email].is_project = True
-            if 'description' in data:
-                existing_maintainers[email].description = data['description']
-            if 'name' in data:
-                existing_maintainers[email].name = data['name']
-            if 'url' in data:
-                existing_maintainers[email].url = data['url']
-        else:
-            print ("Adding project %s" % email)
-            new_maintainer = Maintainer(email=email, is_project=True, description=data['description'], name=data['name'], url=data['url'])
-            db.session.add(new_maintainer)
-            existing_maintainers[email] = new_maintainer
-
-        members = []
+def rebuild_maintainer_closure():
+    """Recompute the project_member_closure and maintainer_package_closure tables from scratch.
 
-        for subproject_email, inherit_members in data['subprojects']:
-            # TODO: How should we handle inherit_members?
-            if subproject_email in existing_maintainers:
-                members.append(existing_maintainers[subproject_email])
-            else:
-                print("Creating new project entry for subproject: %s" % subproject_email)
-                new_subproject = Maintainer(email=subproject_email, is_project=True)
-                db.session.add(new_subproject)
-                existing_maintainers[subproject_email] = new_subproject
-                members.append(new_subproject)
-
-        for member in data['members']:
-            if member['email'] in existing_maintainers:
-                # TODO: Stop overwriting the name from master data, if/once we have a proper sync source for individual maintainers (Gentoo LDAP?)
-                if 'name' in member:
-                    existing_maintainers[member['email']].name = member['name']
-                members.append(existing_maintainers[member['email']])
-            else:
-                print("Adding individual maintainer %s" % member['email'])
-                new_maintainer = Maintainer(email=member['email'], is_project=False, name=member['name'] if 'name' in member else None)
-                db.session.add(new_maintainer)
-                existing_maintainers[member['email']] = new_maintainer
-                members.append(new_maintainer)
-
-        # TODO: Include role information in the association?
-        existing_maintainers[email].members = members
+    Members of a subproject with inherit-members count as members of the parent project
+    too, recursively. The effective packages of a maintainer are the ones they maintain
+    directly plus those of every project they are an effective member of; of several
+    ways to the same package, the direct one or else the shortest path is kept.
+    """
+    rel = maintainer_project_membership_rel_table
+    members = {} # project id -> [(member or subproject id, inherit_members)]
+    for project_id, maintainer_id, inherit_members in db.session.query(rel.c.project_id, rel.c.maintainer_id, rel.c.inherit_members):
+        members.setdefault(project_id, []).append((maintainer_id, inherit_members))
+    project_emails = dict(db.session.query(Maintainer.id, Maintainer.email).filter_by(is_project=True))
+
+    member_rows = []
+    for project_id in members:
+        # Breadth-first through inherit-members subprojects, so that every member is reached by a shortest path first
+        seen = {project_id}
+        reached = set()
+        queue = deque([(project_id, [project_id])]) # (subproject, path of projects from it up to project_id)
+        while queue:
+            current, path = queue.popleft()
+            for maintainer_id, inherit_members in members.get(current, ()):
+                if maintainer_id in project_emails:
+                    if inherit_members and maintainer_id not in seen:
+                        seen.add(maintainer_id)
+                        queue.append((maintainer_id, [maintainer_id] + path))
+                elif maintainer_id not in reached:
+                    reached.add(maintainer_id)
+                    member_rows.append({'project_id': project_id, 'maintainer_id': maintainer_id, 'depth': len(path),
+                                        'path': " ".join(project_emails[id] for id in path)})
+
+    members_closure = project_member_closure_table
+    packages_closure = maintainer_package_closure_table
+    db.session.execute(members_closure.delete())
+    db.session.execute(packages_closure.delete())
+    for batch in batches(member_rows, PKGCHECK_BATCH_SIZE):
+        db.session.execute(members_closure.insert(), batch)
+
+    # Every (maintainer, package, via project) candidate, of which the one with the lowest depth wins
+    pkg_rel = package_maintainer_rel_table
+    candidates = union_all(
+        select(pkg_rel.c.maintainer_id, pkg_rel.c.package_id, cast(null(), Integer).label('via_project_id'),
+               cast(null(), members_closure.c.path.type).label('via_path'), literal(0).label('depth')),
+        select(members_closure.c.maintainer_id, pkg_rel.c.package_id, members_closure.c.project_id, members_closure.c.path, members_closure.c.depth)
+            .select_from(members_closure.join(pkg_rel, pkg_rel.c.maintainer_id == members_closure.c.project_id)),
+    ).alias('candidates')
+    ranked = select(candidates, func.row_number().over(partition_by=[candidates.c.maintainer_id, candidates.c.package_id],
+                                                      order_by=[candidates.c.depth, candidates.c.via_project_id]).label('rank')).alias('ranked')
+    db.session.execute(packages_closure.insert().from_select(
+        ['maintainer_id', 'package_id', 'via_project_id', 'via_path'],
+        select(ranked.c.maintainer_id, ranked.c.package_id, ranked.c.via_project_id, ranked.c.via_path).where(ranked.c.rank == 1)))
+
+@journaled('projects')
+def sync_projects(*, journal):
+    with journal.phase('fetch'):
+        response = conditional_get(proj_url, get_validators(proj_url), stream=True)
+        if not_modified(response):
+            print("projects.xml not modified since last sync")
+            return
+        projects = get_project_data(response)
+    journal.downloaded(response)
+
+    with journal.phase('update'):
+        names = dict(db.session.query(Maintainer.email, Maintainer.name))
+        upsert(Maintainer, [{
+            'email': email,
+            'is_project': True,
+            'name': data.get('name'),
+            'description': data.get('description'),
+            'url': data.get('url'),
+        } for email, data in projects.items()], ['email'], update=['is_project'], keep_existing=['name', 'description', 'url'])
+        upsert(Maintainer, [{'email': subproject_email, 'is_project': True}
+                            for data in projects.values() for subproject_email, inherit_members in data['subprojects']], ['email'])
+        # TODO: Stop overwriting the name from master data, if/once we have a proper sync source for individual maintainers (Gentoo LDAP?)
+        upsert(Maintainer, [{'email': member['email'], 'is_project': False, 'name': member.get('name')}
+                            for data in projects.values() for member in data['members']], ['email'], keep_existing=['name'])
+
+        emails = set(projects)
+        for data in projects.values():
+            emails.update(subproject_email for subproject_email, inherit_members in data['subprojects'])
+            emails.update(member['email'] for member in data['members'])
+        maintainer_ids = lookup_ids(Maintainer, Maintainer.email, emails)
+        memberships = {} # (project id, member or subproject id) -> inherit_members
+        for email, data in projects.items():
+            for subproject_email, inherit_members in data['subprojects']:
+                memberships[(maintainer_ids[email], maintainer_ids[subproject_email])] = inherit_members
+            # TODO: Include role information in the association?
+            for member in data['members']:
+                memberships.setdefault((maintainer_ids[email], maintainer_ids[member['email']]), False)
+        rel = maintainer_project_membership_rel_table
+        replace_links(rel, [rel.c.project_id, rel.c.maintainer_id, rel.c.inherit_members], [maintainer_ids[email] for email in projects],
+                      set((project_id, maintainer_id, inherit_members) for (project_id, maintainer_id), inherit_members in memberships.items()))
+        rebuild_maintainer_closure()
+        # Maintainer names are indexed for search along with the packages they maintain
+        renamed = [id for email, id, name in db.session.query(Maintainer.email, Maintainer.id, Maintainer.name) if email in names and names[email] != name]
+        if renamed:
+            rel = package_maintainer_rel_table
+            refresh_search_index([package_id for package_id, in db.session.query(rel.c.package_id).filter(rel.c.maintainer_id.in_(renamed)).distinct()])
+    print("Synced %d projects with %d memberships" % (len(projects), len(memberships)))
+    journal.processed = len(projects)
+    if projects:
+        remember_response(proj_url, response)
+        mark_synced('projects')
     db.session.commit()
 
-def sync_categories():
+@journaled('categories')
+def sync_categories(*, journal):
     url = pkg_url_base + "categories.json"
-    data = http_session.get(url)
-    # TODO: Handle response error (if not data)
+    with journal.phase('fetch'):
+        data = conditional_get(url, get_validators(url))
+    if not_modified(data):
+        print("categories.json not modified since last sync")
+        return
+    if not data:
+        raise SyncFailed("Failed retrieving categories.json: %s" % data.status_code)
+    journal.downloaded(data)
     categories = data.json()
-    # TODO: Use UPSERT instead (on_conflict_do_update) if we can rely on postgresql:9.5
-    existing_categories = {cat.name: cat for cat in Category.query.all()}
-    for category in categories:
-        if category['name'] in existing_categories:
-            existing_categories[category['name']].description = category['description']
-        else:
-            new_cat = Category(name=category['name'], description=category['description'])
-            db.session.add(new_cat)
-    db.session.commit()
-
-def sync_packages():
-    for category in Category.query.all():
-        data = http_session.get(pkg_url_base + "categories/" + category.name + ".json")
-        if not data:
-            print("No JSON data for category %s" % category.name) # FIXME: Better handling; mark category as inactive/gone?
-            continue
-        packages = data.json()['packages']
-        # TODO: Use UPSERT instead (on_conflict_do_update)
-
-        existing_packages = {pkg.name: pkg for pkg in category.packages}
-
-        for package in packages:
-            if package['name'] in existing_packages:
-                continue # TODO: Update description once we keep that in DB
-            else:
-                new_pkg = Package(category=category, name=package['name'])
-                db.session.add(new_pkg)
+    journal.processed = len(categories)
+    upsert(Category, [{'name': category['name'], 'description': category['description']} for category in categories],
+           ['name'], update=['description'])
+    remember_response(url, data)
+    mark_synced('categories')
     db.session.commit()
 
-def sync_pkgcheck():
-    data = http_session.get("https://gitweb.gentoo.org/report/gentoo-ci.git/plain/output.xml")
-    root = ET.fromstring(data.content)
+@journaled('packages', resumable=True)
+def sync_packages(workers=1, *, journal):
+    """Synchronize the package lists of all categories.
 
-    if root.tag.lower() != 'checks':
-        print("Downloaded gentoo-ci output.xml root tag isn't 'checks'")
-        return
-
-    PkgCheck.query.delete()
+    With workers > 1 the category JSON is downloaded and decoded by a pool of that
+    many processes, while the results are applied here in category order.
 
-    for result_elem in root:
+    Progress is committed after every category; a run that was interrupted is
+    resumed by the next one after the last committed category.
+    """
+    cache_entries = load_http_cache()
+    categories = Category.query.order_by(Category.name)
+    if journal.resume_from:
+        categories = categories.filter(Category.name > journal.resume_from)
+    categories = categories.all()
+    jobs = []
+    for category in categories:
+        url = pkg_url_base + "categories/" + category.name + ".json"
+        jobs.append((url, get_validators(url, cache_entries)))
+
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        changes = pool.imap(fetch_category_change, jobs) if pool else map(fetch_category_change, jobs)
+        for category, (url, validators), change in journal.timed(zip(categories, jobs, changes), 'fetch'):
+            journal.processed += 1
+            journal.bytes_downloaded += change['bytes']
+            if change['status'] == 'not_modified':
+                continue
+            if change['status'] == 'failed':
+                print("No JSON data for category %s" % category.name) # FIXME: Better handling; mark category as inactive/gone?
+                journal.failed += 1
+                continue
+            # TODO: Update description once we keep that in DB
+            upsert(Package, [{'category_id': category.id, 'name': name} for name in change['packages']], ['category_id', 'name'])
+            # In the same transaction, so new packages are searchable in the generation they appear in
+            index_new_packages(category.id)
+            remember_validators(url, change['etag'], change['last_modified'], cache_entries)
+            mark_synced('packages')
+            journal.checkpoint(category.name)
+    finally:
+        if pool:
+            pool.terminate()
+
+def iter_pkgcheck_results(results, category_ids, package_ids, version_ids):
+    """Yield PkgCheck row mappings for the given <result> elements.
+
+    Names are resolved to row ids via the category_ids (name->id), package_ids
+    ((category_id, name)->id) and version_ids ((package_id, version)->id) dicts.
+    """
+    for result_elem in results:
         if result_elem.tag.lower() != 'result':
             print("Skipping unknown <checks> subtag <%s>" % result_elem.tag)
             continue
 
         check = {
-            'category': None,
-            'package': None,
-            'version': None,
-            'class': '',
+            'category_id': None,
+            'package_id': None,
+            'version_id': None,
+            'violationclass': '',
             'message': '',
         }
+        package_name = None
 
         for elem in result_elem:
             tag = elem.tag.lower()
             text = elem.text
 
             if tag == 'category':
-                category = Category.query.filter_by(name=text).first()
-                if category:
-                    check['category'] = category
-                else:
+                check['category_id'] = category_ids.get(text)
+                if check['category_id'] is None:
                     print("Skipping unknown category <%s>" % text)
             elif tag == 'package':
-                if check['category']:
-                    package = Package.query.filter_by(category=check['category'],name=text).first()
-                    if package:
-                        check['package'] = package
-                    else:
+                if check['category_id']:
+                    check['package_id'] = package_ids.get((check['category_id'], text))
+                    package_name = text
+                    if check['package_id'] is None:
                         print("Skipping unknown package <%s>" % text)
                 else:
                     print("Skipping package <%s> for which no category is defined" % text)
             elif tag == 'version':
-                if check['package']:
-                    version = PackageVersion.query.filter_by(package=check['package'], version=text).first()
-                    if version:
-                        check['version'] = version
-                    else:
-                        print("Skipping unknown version <%s-%s>" % (check['package'].name, text))
+                if check['package_id']:
+                    check['version_id'] = version_ids.get((check['package_id'], text))
+                    if check['version_id'] is None:
+                        print("Skipping unknown version <%s-%s>" % (package_name, text))
                 else:
                     print("Skipping version <%s> for which no package is defined" % text)
             elif tag == 'class':
-                check['class'] = elem.text.lower()
+                check['violationclass'] = elem.text.lower()
             elif tag == 'msg':
                 check['message'] = elem.text.lower()
 
-        pkgcheck = PkgCheck(category=check['category'], package=check['package'], version=check['version'], violationclass=check['class'], message=check['message'])
-        db.session.add(pkgcheck)
+        yield check
+
+def pkgcheck_key(check):
+    """Stable identity of a pkgcheck result, used to diff a new report against the stored one"""
+    return (check['category_id'], check['package_id'], check['version_id'], check['violationclass'], check['message'])
+
+@journaled('pkgcheck')
+def sync_pkgcheck(full=False, *, journal):
+    """Synchronize gentoo-ci pkgcheck results.
+
+    By default the new report is diffed against the stored results: only new results
+    are inserted and only vanished ones deleted, leaving unchanged rows alone. With
+    full=True the report is downloaded even if unchanged, the whole report inserted
+    and all previously stored results deleted.
 
+    New results are staged in pkg_check_staging, committed every PKGCHECK_BATCH_SIZE
+    rows, and only moved to pkg_check along with deleting the vanished ones in the last
+    transaction. So the site keeps showing the previous report until then, and an
+    interrupted run leaves it untouched.
+    """
+    with journal.phase('fetch'):
+        data = conditional_get(pkgcheck_url, None if full else get_validators(pkgcheck_url), stream=True)
+    if not_modified(data):
+        print("gentoo-ci output.xml not modified since last sync")
+        return
+    if not data:
+        raise SyncFailed("Failed retrieving gentoo-ci output.xml")
+    root, results = iterparse_children(data)
+
+    if root.tag.lower() != 'checks':
+        raise SyncFailed("Downloaded gentoo-ci output.xml root tag isn't 'checks'")
+
+    # Resolve names with in-memory maps loaded once, instead of up to three SELECTs per result
+    category_ids = dict(db.session.query(Category.name, Category.id))
+    package_ids = {(category_id, name): id for id, category_id, name in db.session.query(Package.id, Package.category_id, Package.name)}
+    version_ids = {(package_id, version): id for id, package_id, version in db.session.query(PackageVersion.id, PackageVersion.package_id, PackageVersion.version)}
+
+    # key -> ids of stored rows; a list, as a report can legitimately contain the same result twice
+    existing = {}
+    stored = db.session.query(PkgCheck.id, PkgCheck.category_id, PkgCheck.package_id, PkgCheck.version_id, PkgCheck.violationclass, PkgCheck.message)
+    if full:
+        vanished = [row[0] for row in stored]
+    else:
+        for row in stored:
+            existing.setdefault(tuple(row[1:]), []).append(row[0])
+
+    # Left behind by an interrupted run
+    staging = pkg_check_staging_table
+    db.session.execute(staging.delete())
+    # Every batch is committed on its own, so that writes of the site (like saving follows) don't wait for the whole report
+    added = unchanged = 0
+    batch = []
+    for check in iter_pkgcheck_results(results, category_ids, package_ids, version_ids):
+        ids = existing.get(pkgcheck_key(check))
+        if ids:
+            ids.pop()
+            unchanged += 1
+            continue
+        batch.append(check)
+        if len(batch) >= PKGCHECK_BATCH_SIZE:
+            db.session.execute(staging.insert(), batch)
+            added += len(batch)
+            batch = []
+            journal.checkpoint()
+    if batch:
+        db.session.execute(staging.insert(), batch)
+        added += len(batch)
+        journal.checkpoint()
+
+    with journal.phase('update'):
+        if not full:
+            vanished = [id for ids in existing.values() for id in ids]
+        for vanished_batch in batches(vanished, PKGCHECK_BATCH_SIZE):
+            db.session.execute(PkgCheck.__table__.delete().where(PkgCheck.id.in_(vanished_batch)))
+        # Versions removed by a sync_versions meanwhile lose their results' version link, like in reconcile_versions
+        columns = [staging.c.category_id, staging.c.package_id, PackageVersion.id, staging.c.violationclass, staging.c.message]
+        db.session.execute(PkgCheck.__table__.insert().from_select(
+            ['category_id', 'package_id', 'version_id', 'violationclass', 'message'],
+            select(*columns).select_from(staging.outerjoin(PackageVersion.__table__, PackageVersion.id == staging.c.version_id))))
+        db.session.execute(staging.delete())
+
+    print("pkgcheck results: %d added, %d removed, %d unchanged" % (added, len(vanished), unchanged))
+    journal.processed = added + unchanged
+    journal.downloaded(data)
+    remember_response(pkgcheck_url, data)
+    mark_synced('pkgcheck')
     db.session.commit()
 
-def sync_versions():
+def assign_arch_bits(arch_bits, keywords):
+    """Extend the arch name->bit map with the arches of keywords not seen before, storing a bit for each"""
+    new_arches = sorted(set(keyword.lstrip('~') for keyword in keywords if not keyword.startswith('-')) - set(arch_bits))
+    if not new_arches:
+        return
+    next_bit = max((bit for bit in arch_bits.values() if bit is not None), default=-1) + 1
+    rows = []
+    for arch in new_arches:
+        if next_bit >= MAX_ARCH_BITS:
+            print("No bit left for arch %s in the keyword bitmasks, leaving it out of them" % arch)
+            arch_bits[arch] = None
+            continue
+        rows.append({'name': arch, 'bit': next_bit})
+        next_bit += 1
+    upsert(Arch, rows, ['name'])
+    arch_bits.update(db.session.query(Arch.name, Arch.bit).filter(Arch.name.in_([row['name'] for row in rows])))
+
+def arch_masks(keywords, arch_bits):
+    """Return the (stable, testing) bitmasks of a version's keywords; testing has only the arches that aren't stable"""
+    stable = testing = 0
+    for keyword in keywords:
+        if keyword.startswith('-'):
+            continue
+        bit = arch_bits.get(keyword.lstrip('~'))
+        if bit is None:
+            continue
+        if keyword.startswith('~'):
+            testing |= 1 << bit
+        else:
+            stable |= 1 << bit
+    return stable, testing & ~stable
+
+def update_arch_masks(masks):
+    """Store (version id, stable, testing) bitmasks on PackageVersion rows"""
+    table = PackageVersion.__table__
+    statement = table.update().where(table.c.id == bindparam('version_id')) \
+        .values(stable_arches=bindparam('stable'), testing_arches=bindparam('testing'))
+    for batch in batches(masks):
+        db.session.execute(statement, [{'version_id': version_id, 'stable': stable, 'testing': testing} for version_id, stable, testing in batch])
+
+def rebuild_arch_masks():
+    """Recompute the keyword bitmasks of all versions from package_version_keywords_rel, e.g. after adding the columns"""
+    rel = package_version_keywords_rel_table
+    keywords = {version_id: [] for version_id, in db.session.query(PackageVersion.id)}
+    for version_id, keyword in db.session.query(rel.c.package_version_id, Keyword.name).join(Keyword, Keyword.id == rel.c.keyword_id):
+        keywords[version_id].append(keyword)
+    arch_bits = dict(db.session.query(Arch.name, Arch.bit))
+    assign_arch_bits(arch_bits, set(keyword for version_keywords in keywords.values() for keyword in version_keywords))
+    update_arch_masks([(version_id,) + arch_masks(version_keywords, arch_bits) for version_id, version_keywords in keywords.items()])
+    print("Computed keyword bitmasks of %d versions over %d arches" % (len(keywords), len(arch_bits)))
+
+def fill_version_sort_keys():
+    """Compute the missing sort keys of versions, e.g. after adding the column"""
+    table = PackageVersion.__table__
+    statement = table.update().where(table.c.id == bindparam('version_id')).values(sort_key=bindparam('sort_key'))
+    rows = [{'version_id': version_id, 'sort_key': try_version_sort_key(version)}
+            for version_id, version in db.session.query(PackageVersion.id, PackageVersion.version).filter(PackageVersion.sort_key == None)]
+    for batch in batches(rows):
+        db.session.execute(statement, batch)
+    invalid = [row['version_id'] for row in rows if row['sort_key'] is None]
+    print("Computed sort keys of %d versions%s" % (len(rows) - len(invalid), ", %d invalid ones left without" % len(invalid) if invalid else ""))
+
+def reconcile_versions(versions_by_package, keyword_ids):
+    """Make the stored versions and keywords of packages match versions_by_package.
+
+    versions_by_package maps package ids to lists of {'version': ..., 'keywords': [...]}
+    dicts as found in the package JSON; keyword_ids is the name->id map of keywords known
+    to the run, extended with any new keywords. Versions are upserted and keywords
+    reconciled as a set difference of (version id, keyword id) pairs against
+    package_version_keywords_rel, inserting and deleting only the changed rows in bulk,
+    instead of going through the ORM collection of every version.
+    """
+    wanted_versions = {(package_id, version['version']): set(version['keywords'])
+                       for package_id, versions in versions_by_package.items() for version in versions}
+
+    # 3.1. add new versions and 4.1. new keywords
+    upsert(PackageVersion, [{'package_id': package_id, 'version': version, 'sort_key': try_version_sort_key(version)} for package_id, version in wanted_versions],
+           ['package_id', 'version'])
+    version_ids = {}
+    stored_masks = {}
+    for batch in batches(versions_by_package):
+        for id, package_id, version, stable, testing in db.session.query(PackageVersion.id, PackageVersion.package_id, PackageVersion.version,
+                                                                         PackageVersion.stable_arches, PackageVersion.testing_arches) \
+                .filter(PackageVersion.package_id.in_(batch)):
+            version_ids[(package_id, version)] = id
+            stored_masks[id] = (stable, testing)
+    used_keywords = set().union(*wanted_versions.values())
+    # TODO: keywords should be initialized earlier to not have to worry about their existence here
+    new_keywords = used_keywords - set(keyword_ids)
+    if new_keywords:
+        upsert(Keyword, [{'name': keyword} for keyword in new_keywords], ['name'])
+        keyword_ids.update(lookup_ids(Keyword, Keyword.name, new_keywords))
+
+    # 4.2. link new keywords and unlink removed ones (including all of dead revisions); Keyword rows are shared and stay
+    wanted = set()
+    for key, keywords in wanted_versions.items():
+        version_id = version_ids[key]
+        wanted.update((version_id, keyword_ids[keyword]) for keyword in keywords)
+    rel = package_version_keywords_rel_table
+    replace_links(rel, [rel.c.package_version_id, rel.c.keyword_id], version_ids.values(), wanted)
+
+    # 4.3. keep the derived keyword bitmasks in step
+    arch_bits = dict(db.session.query(Arch.name, Arch.bit))
+    assign_arch_bits(arch_bits, used_keywords)
+    masks = []
+    for key, keywords in wanted_versions.items():
+        version_id = version_ids[key]
+        stable, testing = arch_masks(keywords, arch_bits)
+        if stored_masks[version_id] != (stable, testing):
+            masks.append((version_id, stable, testing))
+    update_arch_masks(masks)
+
+    # 3.2. cleanup dead revisions
+    dead_ids = [version_id for key, version_id in version_ids.items() if key not in wanted_versions]
+    for batch in batches(dead_ids):
+        db.session.execute(PkgCheck.__table__.update().where(PkgCheck.version_id.in_(batch)).values(version_id=None))
+        db.session.execute(PackageVersion.__table__.delete().where(PackageVersion.id.in_(batch)))
+
+def apply_package_changes(changes, maintainer_ids, keyword_ids):
+    """Update the description, maintainers, versions and keywords of packages from normalized change sets.
+
+    changes is a list of (package, change set) tuples, applied together with a fixed number
+    of bulk statements. maintainer_ids and keyword_ids are the email->id and name->id maps
+    of the run, which get extended with any maintainers and keywords seen for the first time.
+    """
+    # 1. refresh description
+    for package, change in changes:
+        if 'description' in change:
+            package.description = change['description']
+
+    # 2. refresh maintainers, adding the ones we haven't seen yet
+    new_maintainers = [{'email': email, 'is_project': is_project, 'name': name}
+                       for package, change in changes for email, is_project, name in change['maintainers'] if email not in maintainer_ids]
+    if new_maintainers:
+        upsert(Maintainer, new_maintainers, ['email'])
+        maintainer_ids.update(lookup_ids(Maintainer, Maintainer.email, [maintainer['email'] for maintainer in new_maintainers]))
+
+    # Intentionally outside if 'maintainers' in pkg, because if there are no maintainers in JSON, it's falled to maintainer-needed and we need to clean out old maintainer entries
+    # TODO: Retain order to know who is primary; retain description associated with the maintainership
+    rel = package_maintainer_rel_table
+    replace_links(rel, [rel.c.package_id, rel.c.maintainer_id], [package.id for package, change in changes],
+                  set((package.id, maintainer_ids[email]) for package, change in changes for email, is_project, name in change['maintainers']))
+
+    # 3. refresh versions and 4. their keywords
+    reconcile_versions({package.id: change['versions'] for package, change in changes}, keyword_ids)
+
+    # 6. search index, which covers the description and maintainers
+    db.session.flush()
+    refresh_search_index([package.id for package, change in changes])
+
+@journaled('versions')
+def sync_versions(jobs=SYNC_FETCH_JOBS, rate_limit=SYNC_RATE_LIMIT, workers=1, *, journal):
     """Synchronize packages version data from packages.gentoo.org.
 
     For each package that has not been updated in the last SYNC_BUFFER_SECS,
     pull package information and refresh its description, maintainers,
     versions and keywords.
+
+    Package JSON is downloaded by `jobs` concurrent threads, throttled to
+    `rate_limit` requests per second, while all DB updates happen here.
+    With workers > 1 the packages are sharded by category over that many
+    processes (each with `jobs` threads), which also take over the JSON
+    decoding and normalization, leaving only applying the changes to this one.
+    Packages whose JSON is unchanged since the last sync (HTTP 304) are only
+    marked as refreshed.
+
+    Changes are applied in bulk and committed every SYNC_TRANSACTION_SIZE
+    fetched packages, changed or not. As each committed package has its
+    last_sync_ts bumped, an interrupted run is resumed simply by running again.
     """
     cnt = 0
     ts = datetime.utcfromtimestamp(time.time() - SYNC_BUFFER_SECS)
     now = datetime.utcnow()
-    existing_maintainers = {}
-    for maintainer in Maintainer.query.all():
-        existing_maintainers[maintainer.email] = maintainer
+    with journal.phase('prepare'):
+        maintainer_ids = {} # email->id, filled in as maintainers are encountered
+        keyword_ids = dict(db.session.query(Keyword.name, Keyword.id))
+        cache_entries = load_http_cache()
+        packages_to_sync = Package.query.filter(Package.last_sync_ts < ts).order_by(Package.last_sync_ts).all()
+    unchanged = changed = 0
+    pending = [] # (package, change) of changed packages, applied in bulk before each commit
+
+    def apply_pending():
+        with journal.phase('update'):
+            apply_package_changes(pending, maintainer_ids, keyword_ids)
+            remember_many_validators([(package_json_url(package.full_name), change['etag'], change['last_modified']) for package, change in pending], cache_entries)
+            mark_synced('versions')
+        pending.clear()
 
-    all_keywords = {kwd.name: kwd for kwd in Keyword.query.all()}
-
-    packages_to_sync = Package.query.filter(Package.last_sync_ts < ts).order_by(Package.last_sync_ts).all()
     print("Going to sync %d packages%s" % (len(packages_to_sync), (" (oldest sync UTC timestamp: %s)" % packages_to_sync[0].last_sync_ts if len(packages_to_sync) else "")))
 
-    for package in packages_to_sync:
+    start = time.monotonic()
+    last_package = None
+    if workers > 1:
+        changes = fetch_packages_sharded(packages_to_sync, cache_entries, workers, jobs, rate_limit)
+    else:
+        changes = fetch_packages(packages_to_sync, cache_entries, jobs, rate_limit)
+    for package, change in journal.timed(changes, 'fetch'):
+        if cnt and not cnt % SYNC_TRANSACTION_SIZE:
+            print("%d packages updated (%.1f packages/s), committing DB transaction" % (cnt, cnt / (time.monotonic() - start)))
+            if pending:
+                apply_pending()
+            journal.checkpoint(last_package)
+            now = datetime.utcnow()
+
         cnt += 1
-        data = http_session.get(pkg_url_base + "packages/" + package.full_name + ".json")
-        if not data:
+        journal.processed += 1
+        journal.bytes_downloaded += change['bytes']
+        last_package = package.full_name
+        if change['status'] == 'not_modified':
+            package.last_sync_ts = now
+            unchanged += 1
+            continue
+        if change['status'] == 'failed':
             print("No JSON data for package %s" % package.full_name) # FIXME: Handle better; e.g mark the package as removed if no pkgmove update
+            journal.failed += 1
             continue
 
-        pkg = data.json()
-
         print ("Updating package: %s" % package.full_name)
-
-        # 1. refresh description
-        if 'description' in pkg:
-            package.description = pkg['description']
-
-        # 2. refresh maintainers
-        maintainers = []
-        for maint in pkg.get('maintainers', []):
-            if 'email' not in maint or 'type' not in maint:
-                raise ValueError(
-                    "Package %s maintainer %s entry not GLEP 67 valid" %
-                    (package.full_name, maint)
-                )
-
-            email = maint['email'].lower()
-            if email in existing_maintainers:
-                maintainers.append(existing_maintainers[email])
-            else:
-                is_project = False
-                if maint['type'] == 'project':
-                    is_project = True
-                print("Adding %s maintainer %s" % ("project" if is_project else "individual", email))
-                new_maintainer = Maintainer(email=email, is_project=is_project, name=maint.get('name'))
-                db.session.add(new_maintainer)
-                existing_maintainers[email] = new_maintainer
-                maintainers.append(new_maintainer)
-
-        # Intentionally outside if 'maintainers' in pkg, because if there are no maintainers in JSON, it's falled to maintainer-needed and we need to clean out old maintainer entries
-        package.maintainers = maintainers # TODO: Retain order to know who is primary; retain description associated with the maintainership
-
-        # 3.1. refresh versions
-        pkg_versions = {pkgver.version: pkgver for pkgver in package.versions}
-        for version in pkg['versions']:
-            if version['version'] not in pkg_versions:
-                pkgver = PackageVersion(version=version['version'],
-                                        package=package)
-                db.session.add(pkgver)
-            else:
-                pkgver = pkg_versions[version['version']]
-
-            pkg_keywords = {kwd.name: kwd for kwd in pkgver.keywords}
-
-            # 4.1. synchronize new keywords
-            for keyword in version['keywords']:
-                if keyword in pkg_keywords:
-                    continue
-
-                # TODO: keywords should be initialized earlier to not have to
-                # worry about their existence here
-                if keyword not in all_keywords:
-                    kwd = Keyword(name=keyword)
-                    db.session.add(kwd)
-                    all_keywords[keyword] = kwd
-
-                pkgver.keywords.append(all_keywords[keyword])
-
-            # 4.2. cleanup removed keywords
-            for keyword, kwd_obj in pkg_keywords.items():
-                if keyword not in version['keywords']:
-                    db.session.delete(kwd_obj)
-
-        # 3.2 cleanup dead revisions
-        for version, ver_obj in pkg_versions.items():
-            if version not in pkg['versions']:
-                db.session.delete(ver_obj)
-
         # 5. mark package as refreshed
         package.last_sync_ts = now
-
-        if not cnt % 100:
-            print("%d packages updated, committing DB transaction" % cnt)
-            db.session.commit()
-            now = datetime.utcnow()
-
+        pending.append((package, change))
+        changed += 1
+
+    if pending:
+        apply_pending()
+    # Also after an interrupted run, whose committed changes may not have made it into the closure yet
+    if changed or journal.interrupted:
+        with journal.phase('closure'):
+            rebuild_maintainer_closure()
+            # In the same transaction, so that pages cached for the generation before are dropped along with the old closure
+            mark_synced('versions')
     db.session.commit()
+    elapsed = time.monotonic() - start
+    print("Synced %d packages (%d unchanged) in %.1f seconds (%.1f packages/s)" % (cnt, unchanged, elapsed, cnt / elapsed if elapsed else 0))
@@ -0,0 +1,71 @@
+import re
+
+# Package Manager Specification, section 3.2 "Version Specifications"
+VERSION_RE = re.compile(r'^(\d+)((?:\.\d+)*)([a-z]?)((?:_(?:alpha|beta|pre|rc|p)\d*)*)(?:-r(\d+))?$')
+SUFFIX_RE = re.compile(r'_(alpha|beta|pre|rc|p)(\d*)')
+
+# Sort key building blocks, chosen so that plain (C collation / byte) string order of the keys is PMS version order
+KEY_NUMBERS_END = '-'  # after the last numeric component; sorts before another component
+KEY_ZERO_COMPONENT = 'A'  # component with a leading zero, compared as a string; always sorts before a plain one
+KEY_COMPONENT = 'B'
+KEY_STRING_END = '!'  # terminates a KEY_ZERO_COMPONENT string; sorts before any digit
+KEY_NO_LETTER = '0'  # sorts before any letter
+KEY_SUFFIXES = {'alpha': 'a', 'beta': 'b', 'pre': 'c', 'rc': 'd', 'p': 'f'}
+KEY_SUFFIXES_END = 'e'  # no (further) suffix sorts after _rc but before _p
+
+
+def parse_version(version):
+    """Split a PMS version string into (numbers, letter, suffixes, revision).
+
+    numbers is the list of numeric components as strings, letter is '' if there is none,
+    suffixes is a list of (suffix, number) tuples and revision an int. Raises ValueError
+    for strings that aren't valid versions.
+    """
+    match = VERSION_RE.match(version)
+    if not match:
+        raise ValueError("Invalid version: %s" % version)
+    first, rest, letter, suffixes, revision = match.groups()
+    numbers = [first] + rest.split('.')[1:]
+    return (numbers, letter,
+            [(suffix, int(number or 0)) for suffix, number in SUFFIX_RE.findall(suffixes)],
+            int(revision or 0))
+
+def _int_key(number):
+    digits = str(int(number))
+    if len(digits) > 99:
+        raise ValueError("Version component too long: %s" % number)
+    return "%02d%s" % (len(digits), digits)
+
+def version_sort_key(version):
+    """Return a string that sorts like version does by the PMS version comparison algorithm.
+
+    Versions the algorithm deems equal (like 1.0 and 1.00, or 1 and 1-r0) get the same key.
+    Raises ValueError for invalid versions.
+    """
+    numbers, letter, suffixes, revision = parse_version(version)
+    key = [_int_key(numbers[0])]
+    for number in numbers[1:]:
+        if number.startswith('0'):
+            # PMS 3.3: compared as strings with trailing zeros stripped if either side has a leading zero
+            key.append(KEY_ZERO_COMPONENT + number.rstrip('0') + KEY_STRING_END)
+        else:
+            key.append(KEY_COMPONENT + _int_key(number))
+    key.append(KEY_NUMBERS_END)
+    key.append(letter or KEY_NO_LETTER)
+    for suffix, number in suffixes:
+        key.append(KEY_SUFFIXES[suffix] + _int_key(number))
+    key.append(KEY_SUFFIXES_END)
+    key.append(_int_key(revision))
+    return "".join(key)
+
+def try_version_sort_key(version):
+    """version_sort_key, or None for invalid versions"""
+    try:
+        return version_sort_key(version)
+    except ValueError:
+        return None
+
+def vercmp(a, b):
+    """Compare two versions by the PMS algorithm; returns -1, 0 or 1 like the C library cmp functions"""
+    a_key, b_key = version_sort_key(a), version_sort_key(b)
+    return (a_key > b_key) - (a_key < b_key)
@@ -1,5 +1,7 @@
-from .grumpy import GrumpyView, SetupView
+from .api import ApiView
+from .grumpy import DashboardView, GrumpyView, SetupView, StatsView
+from .profiling import RequestProfiler
 
 __all__ = [
-    "GrumpyView", "SetupView",
+    "ApiView", "DashboardView", "GrumpyView", "RequestProfiler", "SetupView", "StatsView",
 ]
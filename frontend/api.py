@@ -0,0 +1,158 @@
+import hashlib
+from functools import wraps
+
+from flask import abort, current_app, jsonify, make_response, request
+from flask_classy import FlaskView, route
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
+
+from backend.lib import models, reports, search
+from .grumpy import effective_packages_query, keyset_page, next_page_url, page_size
+
+API_VERSION = 1 # Bump on incompatible output changes, so clients and caches don't keep using old ETags
+
+
+def sync_etag(last_modified, path):
+    """ETag of the response for path (with query string) as of the sync at last_modified"""
+    return "v%d-%d-%s" % (API_VERSION, int(last_modified.timestamp() * 1000000), hashlib.sha1(path.encode('utf-8')).hexdigest()[:12])
+
+def conditional_on_sync(view):
+    """Make a view cacheable with ETag/Last-Modified derived from the latest sync.
+
+    The data only changes when a sync runs, so a client (or reverse proxy) that already
+    has the response for the latest sync gets a 304 without the view running at all.
+    Only successful responses get the validators. A package can only disappear through
+    a sync, which changes the ETag, so a 304 can't hide a 404; and as the ETag covers the
+    URL too, neither can one a client got for another URL.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        last_modified = models.SyncState.last_change()
+        if last_modified is None:
+            return view(*args, **kwargs)
+        etag = sync_etag(last_modified, request.full_path)
+
+        response = current_app.response_class()
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.make_conditional(request)
+        if response.status_code != 304:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response.set_etag(etag)
+            response.last_modified = last_modified
+        # Let caches store the response, but have them revalidate it on every use
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+def package_summary(package):
+    return {
+        'category': package.category.name,
+        'name': package.name,
+        'description': package.description,
+    }
+
+class ApiView(FlaskView):
+    """Read-only JSON mirror of the GrumpyView pages"""
+    route_base = '/api/v1/'
+    decorators = [conditional_on_sync]
+
+    def index(self):
+        categories = models.Category.query.order_by(models.Category.name)
+        return jsonify(categories=[{'name': category.name, 'description': category.description} for category in categories])
+
+    @route('/category/<categoryname>', methods=['GET'])
+    def category(self, categoryname):
+        category = models.Category.query.filter_by(name=categoryname).first()
+        if not category:
+            abort(404)
+
+        after = request.args.get('after')
+        packages, next_key = keyset_page(models.Package.query.filter_by(category=category),
+                                         [models.Package.name], (after,) if after else None,
+                                         lambda package: (package.name,))
+        return jsonify(
+            name=category.name,
+            description=category.description,
+            packages=[{'name': package.name, 'description': package.description} for package in packages],
+            next=next_page_url(next_key, categoryname=categoryname),
+        )
+
+    @route('/search', methods=['GET'])
+    def search(self):
+        # ?q= words to match, each also as a prefix; best matches first, up to ?per_page= of them
+        query = request.args.get('q', '').strip()
+        packages = search.search_packages(query, page_size()) if query else []
+        return jsonify(query=query, packages=[package_summary(package) for package in packages])
+
+    @route('/maintainer/<email>', methods=['GET'])
+    def maintainer(self, email):
+        maintainer = models.Maintainer.query.filter_by(email=email).first()
+        if not maintainer:
+            abort(404)
+
+        after = request.args.get('after', '').split('/', 1)
+        packages, next_key = keyset_page(effective_packages_query(maintainer), [models.Category.name, models.Package.name],
+                                         after if len(after) == 2 else None,
+                                         lambda row: (row.Package.category.name, row.Package.name))
+        package_ids = [package.id for package, via_path in packages]
+        newest = models.PackageVersion.newest(package_ids)
+        newest_stable = None
+        if request.args.get('arch'):
+            # ?arch= adds the newest version stable on that arch
+            arch = models.Arch.query.filter_by(name=request.args['arch']).first()
+            if not arch:
+                abort(404)
+            newest_stable = models.PackageVersion.newest(package_ids, stable_on=arch)
+        results = []
+        for package, via_path in packages:
+            # via: the projects through which the package is maintained, from the maintainer's own one upwards; empty if directly
+            result = dict(package_summary(package), via=via_path.split() if via_path else [], newest=newest.get(package.id))
+            if newest_stable is not None:
+                result['newest_stable'] = newest_stable.get(package.id)
+            results.append(result)
+        return jsonify(
+            email=maintainer.email,
+            name=maintainer.name,
+            is_project=maintainer.is_project,
+            packages=results,
+            next=next_page_url(next_key, email=email),
+        )
+
+    @route('/package/<categoryname>/<packagename>', methods=['GET'])
+    def package(self, categoryname, packagename):
+        package = models.Package.query.join(models.Package.category) \
+            .filter(models.Category.name == categoryname, models.Package.name == packagename) \
+            .options(contains_eager(models.Package.category),
+                     selectinload(models.Package.maintainers),
+                     selectinload(models.Package.versions).selectinload(models.PackageVersion.keywords)) \
+            .first()
+        if not package:
+            abort(404)
+
+        pkgcheck = models.PkgCheck.query.filter_by(package=package).options(joinedload(models.PkgCheck.version))
+        result = package_summary(package)
+        result.update(
+            maintainers=[maintainer.email for maintainer in package.maintainers],
+            versions=[{
+                'version': version.version,
+                'keywords': sorted(keyword.name for keyword in version.keywords),
+                'masks': version.masks,
+            } for version in package.versions],
+            pkgcheck=[{
+                'version': violation.version.version if violation.version else None,
+                'class': violation.violationclass,
+                'message': violation.message,
+            } for violation in pkgcheck],
+        )
+        return jsonify(result)
+
+    @route('/reports/keywords', methods=['GET'])
+    def keyword_report(self):
+        # ?reference= arch to measure the lag against (default amd64), ?arch= to report a single arch
+        report = reports.keyword_report(request.args.get('reference', 'amd64'), request.args.get('arch'))
+        if report is None:
+            abort(404)
+        return jsonify(report)
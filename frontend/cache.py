@@ -0,0 +1,191 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+
+from backend.lib import models
+
+TMP_PREFIX = '.tmp' # of files still being written to the cache directory
+TMP_MAX_AGE = 60 # seconds after which a temporary file counts as left behind by a crashed worker
+
+
+class PageCache(object):
+    """Size-bounded LRU cache of rendered pages, valid for a single sync generation.
+
+    The DB only changes when a sync runs, so every entry is tied to the generation
+    (the last SyncState change) it was rendered for and the whole cache is dropped once
+    a sync finishes. If cache_dir is given, entries are also kept there as files, which
+    lets multiple worker processes share what any of them rendered; up to max_entries
+    of them too, the oldest written ones going first. Failing to write a file only
+    keeps that page from being shared.
+    """
+    def __init__(self, max_entries, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.generation = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.file_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _switch_generation(self, generation):
+        # Called with self.lock held
+        if generation == self.generation:
+            return
+        self.entries.clear()
+        if self.generation is not None:
+            self.invalidations += 1
+        self.generation = generation
+        if self.cache_dir:
+            prefix = self._generation_prefix(generation)
+            now = time.time()
+            for entry in os.scandir(self.cache_dir):
+                try:
+                    # Temporary files are still being written by some worker, which renames them once done
+                    if entry.name.startswith(TMP_PREFIX) and now - entry.stat().st_mtime < TMP_MAX_AGE:
+                        continue
+                    if not entry.name.startswith(prefix):
+                        os.unlink(entry.path)
+                except OSError:
+                    pass # Already pruned by another worker
+
+    def _generation_prefix(self, generation):
+        return "%s-" % (generation.strftime('%Y%m%d%H%M%S%f') if generation else 'none')
+
+    def _filename(self, key):
+        return os.path.join(self.cache_dir, self._generation_prefix(self.generation) + hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key, generation):
+        with self.lock:
+            self._switch_generation(generation)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            value = None
+            if self.cache_dir:
+                try:
+                    with open(self._filename(key), 'rb') as f:
+                        value = pickle.load(f)
+                except (OSError, EOFError, pickle.UnpicklingError):
+                    pass
+            if value is None:
+                self.misses += 1
+                return None
+            self.file_hits += 1
+            self._store(key, value)
+            return value
+
+    def set(self, key, generation, value):
+        with self.lock:
+            self._switch_generation(generation)
+            self._store(key, value)
+            if self.cache_dir:
+                self._write_file(key, value)
+
+    def _write_file(self, key, value):
+        # Called with self.lock held
+        tmp = None
+        try:
+            self._prune_files()
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix=TMP_PREFIX)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f)
+            os.replace(tmp, self._filename(key))
+        except OSError:
+            # E.g. a full disk, or the file pruned by another worker switching generations meanwhile
+            if tmp:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+    def _prune_files(self):
+        """Make room for another file of the current generation, deleting the oldest ones beyond max_entries - 1"""
+        prefix = self._generation_prefix(self.generation)
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.startswith(prefix):
+                try:
+                    files.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass # Already pruned by another worker
+        if len(files) < self.max_entries:
+            return
+        files.sort()
+        for mtime, path in files[:len(files) - self.max_entries + 1]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _store(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.file_hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'file_hits': self.file_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.file_hits) / lookups if lookups else None,
+                'invalidations': self.invalidations,
+                'generation': self.generation.isoformat() if self.generation else None,
+                'shared_dir': self.cache_dir,
+            }
+
+def get_page_cache():
+    """The app's PageCache, configured by PAGE_CACHE_SIZE (0 disables caching) and PAGE_CACHE_DIR"""
+    if 'page_cache' not in current_app.extensions:
+        current_app.extensions['page_cache'] = PageCache(current_app.config['PAGE_CACHE_SIZE'], current_app.config['PAGE_CACHE_DIR']) if current_app.config['PAGE_CACHE_SIZE'] else None
+    return current_app.extensions['page_cache']
+
+def cached_page(view):
+    """Serve successful GET responses of a view from the page cache, keyed by path and query string"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = get_page_cache()
+        if cache is None or request.method != 'GET':
+            return view(*args, **kwargs)
+
+        key = request.full_path
+        generation = models.SyncState.last_change()
+        cached = cache.get(key, generation)
+        if cached is not None:
+            body, mimetype = cached
+            response = current_app.response_class(body, mimetype=mimetype)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.direct_passthrough:
+            cache.set(key, generation, (response.get_data(), response.mimetype))
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+def cached_for_generation(name, compute):
+    """Return the result of compute() for the current sync generation, computing it once per generation and process"""
+    generation = models.SyncState.last_change()
+    cache = current_app.extensions.setdefault('generation_cache', {})
+    cached = cache.get(name)
+    if cached is None or cached[0] != generation:
+        cached = (generation, compute())
+        cache[name] = cached
+    return cached[1]
@@ -1,11 +1,24 @@
-from flask import abort, current_app, redirect, render_template, request, url_for
+import bisect
+import secrets
+from datetime import datetime, timedelta
+
+from flask import Response, abort, after_this_request, current_app, jsonify, redirect, render_template, request, session, stream_with_context, url_for
 from flask_classy import FlaskView, route
-from sqlalchemy.sql import collate
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.orm import contains_eager, joinedload
 from flask_wtf import FlaskForm
+from flask_wtf.csrf import generate_csrf
 from wtforms import SelectMultipleField, widgets
 
 
-from backend.lib import models
+from backend import db
+from backend.lib import models, search
+from backend.lib.reports import mask_bits
+from .cache import cached_for_generation, cached_page, get_page_cache
+from .profiling import get_profiler
+
+
+FOLLOWER_REFRESH_INTERVAL = timedelta(days=1) # how often a visit updates Follower.updated_ts
 
 
 class MultiCheckboxField(SelectMultipleField):
@@ -15,8 +28,50 @@ class MultiCheckboxField(SelectMultipleField):
 class FollowSetupForm(FlaskForm):
     maintainers = MultiCheckboxField('Followed maintainers', coerce=int)
 
+def page_size():
+    """Requested page size (?per_page=), bounded by the PAGE_SIZE/MAX_PAGE_SIZE config"""
+    per_page = request.args.get('per_page', current_app.config['PAGE_SIZE'], type=int)
+    return max(1, min(per_page, current_app.config['MAX_PAGE_SIZE']))
+
+def keyset_after(columns, values):
+    """SQL condition for rows sorting after values in the (columns...) ordering"""
+    column, value = columns[0], values[0]
+    if len(columns) == 1:
+        return column > value
+    return or_(column > value, and_(column == value, keyset_after(columns[1:], values[1:])))
+
+def keyset_page(query, columns, after, key):
+    """Return (items, next_key) for one page of query ordered by columns, starting after the `after` key tuple.
+
+    Keyset pagination stays cheap for deep pages, unlike OFFSET. key(item) gives the key
+    tuple of an item; next_key is the one to continue after, or None on the last page.
+    """
+    per_page = page_size()
+    if after:
+        query = query.filter(keyset_after(columns, after))
+    items = query.order_by(*columns).limit(per_page + 1).all()
+    if len(items) > per_page:
+        return items[:per_page], key(items[per_page - 1])
+    return items, None
+
+def next_page_url(next_key, param='after', **values):
+    if next_key is None:
+        return None
+    values.update(request.args.to_dict())
+    values[param] = '/'.join(next_key)
+    return url_for(request.endpoint, **values)
+
+def effective_packages_query(maintainer):
+    """Query for (Package, via_path) rows of all packages maintainer maintains directly or through projects"""
+    closure = models.maintainer_package_closure_table
+    return models.Package.query.join(closure, closure.c.package_id == models.Package.id) \
+        .filter(closure.c.maintainer_id == maintainer.id) \
+        .join(models.Package.category).options(contains_eager(models.Package.category)) \
+        .add_columns(closure.c.via_path)
+
 class GrumpyView(FlaskView):
     route_base='/'
+    decorators = [cached_page]
 
     def index(self):
         categories = models.Category.query.all()
@@ -27,66 +82,217 @@ class GrumpyView(FlaskView):
         category = models.Category.query.filter_by(name=categoryname).first()
 
         if category:
-            packages = models.Package.query.filter_by(category=category)
-            return render_template('category.html', category=category, packages=packages)
+            after = request.args.get('after')
+            packages, next_key = keyset_page(models.Package.query.filter_by(category=category),
+                                             [models.Package.name], (after,) if after else None,
+                                             lambda package: (package.name,))
+            return render_template('category.html', category=category, packages=packages,
+                                   next_url=next_page_url(next_key, categoryname=categoryname))
         else:
             abort(404)
 
     @route('/maintainer/<email>', methods=['GET'])
     def maintainer(self, email):
         maintainer = models.Maintainer.query.filter_by(email=email).first()
-        packages = models.Package.query.filter(models.Package.maintainers.contains(maintainer))
 
         if maintainer:
-            return render_template('maintainer.html', maintainer=maintainer, packages=packages)
+            # Paginated by "category/package" full name
+            after = request.args.get('after', '').split('/', 1)
+            packages, next_key = keyset_page(effective_packages_query(maintainer), [models.Category.name, models.Package.name],
+                                             after if len(after) == 2 else None,
+                                             lambda row: (row.Package.category.name, row.Package.name))
+            newest = models.PackageVersion.newest([package.id for package, via_path in packages])
+            return render_template('maintainer.html', maintainer=maintainer, packages=packages, newest=newest,
+                                   next_url=next_page_url(next_key, email=email))
         else:
             abort(404)
 
     @route('/maintainers', methods=['GET'])
     def maintainers(self):
-        people = models.Maintainer.query.filter_by(is_project=False).order_by('email asc')
-        projects = models.Maintainer.query.filter_by(is_project=True).order_by('email asc')
-        return render_template('maintainers.html', people=people, projects=projects)
+        # People and projects are paginated independently, by email
+        people_after = request.args.get('people_after')
+        projects_after = request.args.get('projects_after')
+        people, people_next = keyset_page(models.Maintainer.query.filter_by(is_project=False),
+                                          [models.Maintainer.email], (people_after,) if people_after else None,
+                                          lambda maintainer: (maintainer.email,))
+        projects, projects_next = keyset_page(models.Maintainer.query.filter_by(is_project=True),
+                                              [models.Maintainer.email], (projects_after,) if projects_after else None,
+                                              lambda maintainer: (maintainer.email,))
+        return render_template('maintainers.html', people=people, projects=projects,
+                               people_next_url=next_page_url(people_next, 'people_after'),
+                               projects_next_url=next_page_url(projects_next, 'projects_after'))
 
     @route('/package/<categoryname>/<packagename>', methods=['GET'])
     def package(self, categoryname, packagename):
         category = models.Category.query.filter_by(name=categoryname).first()
         package = models.Package.query.filter_by(category=category,name=packagename).first()
-        pkgcheck = models.PkgCheck.query.filter_by(package=package)
+        pkgcheck = models.PkgCheck.query.filter_by(package=package).options(joinedload(models.PkgCheck.version))
 
         if package:
             return render_template('package.html', category=category, package=package, pkgcheck=pkgcheck)
         else:
             abort(404)
 
+    @route('/search', methods=['GET'])
+    def search(self):
+        query = request.args.get('q', '').strip()
+        packages = search.search_packages(query, page_size()) if query else []
+        return render_template('search.html', query=query, packages=packages)
+
+class StatsView(FlaskView):
+    """Monitoring data; per worker process"""
+    trailing_slash = False
+
+    def cache(self):
+        page_cache = get_page_cache()
+        return jsonify(page_cache.stats() if page_cache else {'enabled': False})
+
+    def profile(self):
+        profiler = get_profiler()
+        return jsonify(profiler.stats() if profiler else {'enabled': False})
+
+def get_follower(create=False):
+    """Return the Follower of the current session, or None if there is none and not create.
+
+    Follows from the "follows" cookie used before they were stored server-side are
+    moved over to a new Follower, and the cookie deleted.
+    """
+    token = session.get('follower')
+    follower = models.Follower.query.filter_by(token=token).first() if token else None
+    if follower is not None and datetime.utcnow() - follower.updated_ts > FOLLOWER_REFRESH_INTERVAL:
+        # Followers still in use are kept from being pruned by ./manage.py prune_followers
+        follower.updated_ts = datetime.utcnow()
+        db.session.commit()
+    legacy_follows = request.cookies.get('follows')
+    if follower is None and (create or legacy_follows):
+        follower = models.Follower(token=secrets.token_urlsafe(32))
+        if legacy_follows:
+            follower.maintainers = models.Maintainer.query.filter(models.Maintainer.email.in_(legacy_follows.split())).all()
+        db.session.add(follower)
+        db.session.commit()
+        session['follower'] = follower.token
+        session.permanent = True
+    if legacy_follows:
+        @after_this_request
+        def forget_legacy_follows(response):
+            response.delete_cookie('follows')
+            return response
+    return follower
+
+def followed_packages_overview(maintainers, after=None):
+    """Aggregate the effective packages of maintainers with their keyword gaps and pkgcheck violations.
+
+    Returns (summary, packages, next_key): summary maps every maintainer id to the totals
+    of their packages, packages is one page of the packages of any of maintainers that
+    have gaps or violations, in full name order, starting after the `after` full name.
+    A keyword gap is an arch the package is only ~arch keyworded on, while stable on others.
+
+    The aggregation is done in SQL over the packages in the closure of maintainers only,
+    so the cost depends on what is followed, not on the size of the tree.
+    """
+    maintainer_ids = [maintainer.id for maintainer in maintainers]
+    closure = models.maintainer_package_closure_table
+    pkgcheck = models.PkgCheck.__table__
+    versions = models.PackageVersion.__table__
+    followed = select(closure.c.package_id).where(closure.c.maintainer_id.in_(maintainer_ids)).distinct().subquery()
+    masks = select(versions.c.package_id, func.bit_or(versions.c.stable_arches).label('stable'), func.bit_or(versions.c.testing_arches).label('testing')) \
+        .join(followed, followed.c.package_id == versions.c.package_id).group_by(versions.c.package_id).subquery()
+    violations = select(pkgcheck.c.package_id, func.count().label('count')) \
+        .join(followed, followed.c.package_id == pkgcheck.c.package_id).group_by(pkgcheck.c.package_id).subquery()
+    # Arches ~arch keyworded on without a stable version, if stable on any
+    gaps = case((masks.c.stable != 0, masks.c.testing - masks.c.testing.op('&')(masks.c.stable)), else_=0)
+
+    summary = {maintainer_id: {'packages': 0, 'keyword_gaps': 0, 'pkgcheck': 0} for maintainer_id in maintainer_ids}
+    attention = {} # package id -> (full name, keyword gap mask, ids of the maintainers it is followed through)
+    for maintainer_id, package_id, category, name, package_gaps, violation_count in db.session.execute(
+            select(closure.c.maintainer_id, closure.c.package_id, models.Category.name, models.Package.name, gaps, violations.c.count)
+            .join(models.Package, models.Package.id == closure.c.package_id).join(models.Package.category)
+            .outerjoin(masks, masks.c.package_id == closure.c.package_id).outerjoin(violations, violations.c.package_id == closure.c.package_id)
+            .where(closure.c.maintainer_id.in_(maintainer_ids))):
+        totals = summary[maintainer_id]
+        totals['packages'] += 1
+        totals['keyword_gaps'] += 1 if package_gaps else 0
+        totals['pkgcheck'] += violation_count or 0
+        if package_gaps or violation_count:
+            attention.setdefault(package_id, ("%s/%s" % (category, name), package_gaps, set()))[2].add(maintainer_id)
+
+    ordered = sorted((full_name, package_id) for package_id, (full_name, package_gaps, package_maintainers) in attention.items())
+    if after:
+        ordered = ordered[bisect.bisect_right(ordered, (after, float('inf'))):]
+    per_page = page_size()
+    page = ordered[:per_page]
+    page_violations = {} # package id -> {violation class: count}, only for the packages shown
+    if page:
+        for package_id, violationclass, count in db.session.execute(select(pkgcheck.c.package_id, pkgcheck.c.violationclass, func.count())
+                                                                    .where(pkgcheck.c.package_id.in_([package_id for full_name, package_id in page]))
+                                                                    .group_by(pkgcheck.c.package_id, pkgcheck.c.violationclass)):
+            page_violations.setdefault(package_id, {})[violationclass] = count
+    arch_names = dict(db.session.query(models.Arch.bit, models.Arch.name))
+    packages = [{
+        'full_name': full_name,
+        'maintainer_ids': [maintainer_id for maintainer_id in maintainer_ids if maintainer_id in attention[package_id][2]],
+        'keyword_gaps': sorted(arch_names[bit] for bit in mask_bits(attention[package_id][1] or 0)),
+        'pkgcheck': page_violations.get(package_id, {}),
+    } for full_name, package_id in page]
+    next_key = (ordered[per_page - 1][0],) if len(ordered) > per_page else None
+    return summary, packages, next_key
+
+class DashboardView(FlaskView):
+    """Overview of the packages of all followed maintainers; per visitor, so not page cached"""
+    def index(self):
+        follower = get_follower()
+        maintainers = sorted(follower.maintainers, key=lambda maintainer: maintainer.email) if follower else []
+        summary, packages, next_key = followed_packages_overview(maintainers, request.args.get('after')) if maintainers else ({}, [], None)
+        return render_template("dashboard.html", maintainers=maintainers, summary=summary, packages=packages,
+                               maintainers_by_id={maintainer.id: maintainer for maintainer in maintainers},
+                               next_url=next_page_url(next_key))
+
+STREAM_BUFFER_SIZE = 100 # template output pieces (tags, variables) per chunk sent of streamed pages
+
+def stream_template(template_name, **context):
+    """Like render_template, but a streamed Response sending the template output as it is generated"""
+    current_app.update_template_context(context)
+    stream = current_app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+    return Response(stream_with_context(stream))
+
+def follow_setup_choices():
+    """Return (choices, developers, projects, proxy maintainers) for the follow setup form.
+
+    choices are the (id, email) tuples of all maintainers, the others (id, label, name)
+    tuples of the respective maintainers, all by email. Cached per sync generation.
+    """
+    def compute():
+        choices, developers, projects, proxies = [], [], [], []
+        for id, email, name, is_project in db.session.query(models.Maintainer.id, models.Maintainer.email, models.Maintainer.name, models.Maintainer.is_project) \
+                .order_by(func.lower(models.Maintainer.email)):
+            choices.append((id, email))
+            if is_project:
+                projects.append((id, email, name))
+            elif email.endswith('@gentoo.org'):
+                developers.append((id, email[:-len('@gentoo.org')], name))
+            else:
+                proxies.append((id, email, name))
+        return tuple(choices), tuple(developers), tuple(projects), tuple(proxies)
+    return cached_for_generation('follow_setup_choices', compute)
+
 class SetupView(FlaskView):
     @route('/', methods=['GET', 'POST']) # FIXME: Can we enable POST without giving a rule override from the automatic, or handle this some other better way with wtforms setup?
     def index(self):
-        maintainers = models.Maintainer.query.order_by(collate(models.Maintainer.email, 'NOCASE')).all()
+        choices, developers, projects, proxies = follow_setup_choices()
         form = FollowSetupForm()
-        choices = []
-        defaults = []
-        form_mapping = {}
-        follows = request.cookies.get('follows', '').split()
-        for maintainer in maintainers:
-            choices.append((maintainer.id, maintainer.email))
-            form_mapping[maintainer.id] = maintainer
-            if maintainer.email in follows:
-                defaults.append(maintainer.id)
-
         form.maintainers.choices = choices
-        form.maintainers.default = defaults
 
         if form.validate_on_submit():
-            followed_maintainers = set()
-            for choice in choices:
-                if choice[0] in form.maintainers.data:
-                    followed_maintainers.add(choice[1])
-            response = current_app.make_response(redirect(url_for('GrumpyView:index')))
-            # FIXME: This will fail with too many following (usually string value length above 4093); move this to session eventually. If that is delayed, we could at least make it fit more by omitting @gentoo.org in those cases (and suffixing it back after cookie read for defaults handling)
-            response.set_cookie('follows', value=' '.join(followed_maintainers))
-            return response
-
-        form.process()
+            follower = get_follower(create=True)
+            follower.maintainers = models.Maintainer.query.filter(models.Maintainer.id.in_(form.maintainers.data)).all() if form.maintainers.data else []
+            follower.updated_ts = datetime.utcnow()
+            db.session.commit()
+            return redirect(url_for('DashboardView:index'))
 
-        return render_template("setup.html", mapping=form_mapping, form=form)
+        follower = get_follower()
+        rel = models.follower_maintainer_rel_table
+        follows = set(id for id, in db.session.query(rel.c.maintainer_id).filter(rel.c.follower_id == follower.id)) if follower else set()
+        # The session (and with it the CSRF token) is saved before a streamed body is generated
+        generate_csrf()
+        return stream_template("setup.html", form=form, follows=follows, developers=developers, projects=projects, proxies=proxies)
@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import jinja2
+from flask import current_app, request
+from sqlalchemy import event
+from werkzeug.wsgi import ClosingIterator
+
+
+class RequestTimes(object):
+    """Queries and time spent in SQL and in rendering templates (less the SQL they triggered) of one request"""
+    def __init__(self):
+        self.route = None
+        self.queries = 0
+        self.sql = 0.0
+        self.template = 0.0
+        self.rendering = 0 # depth of template rendering in progress
+
+class RequestProfiler(object):
+    """WSGI middleware recording per route latency, SQL and template render time.
+
+    Times are taken until the response body is fully sent, so streamed templates are
+    accounted too. Keeps the last `samples` requests of each route for percentiles;
+    per worker process, like the page cache stats.
+    """
+    def __init__(self, app, db, samples=1000):
+        self.wsgi_app = app.wsgi_app
+        self.samples = samples
+        self.routes = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        app.wsgi_app = self
+        app.extensions['profiler'] = self
+        profiler = self
+
+        @app.before_request
+        def remember_route():
+            times = profiler.current()
+            if times is not None:
+                times.route = "%s %s" % (request.method, request.url_rule.rule if request.url_rule else '<unrouted>')
+
+        class TimedTemplate(jinja2.Template):
+            def render(self, *args, **kwargs):
+                with profiler.rendering():
+                    return super(TimedTemplate, self).render(*args, **kwargs)
+
+            def generate(self, *args, **kwargs):
+                chunks = super(TimedTemplate, self).generate(*args, **kwargs)
+                times = profiler.current()
+                if times is None:
+                    yield from chunks
+                    return
+                # Like rendering(), inlined as this runs for every bit of template output
+                while True:
+                    start, sql = time.perf_counter(), times.sql
+                    times.rendering += 1
+                    try:
+                        chunk = next(chunks, StopIteration)
+                    finally:
+                        times.rendering -= 1
+                        if not times.rendering:
+                            times.template += time.perf_counter() - start - (times.sql - sql)
+                    if chunk is StopIteration:
+                        return
+                    yield chunk
+        app.jinja_env.template_class = TimedTemplate
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def current(self):
+        return getattr(self.local, 'times', None)
+
+    @contextmanager
+    def rendering(self):
+        """Account the time spent in the block to template rendering, less the SQL run meanwhile"""
+        times = self.current()
+        if times is None:
+            yield
+            return
+        times.rendering += 1
+        start, sql = time.perf_counter(), times.sql
+        try:
+            yield
+        finally:
+            times.rendering -= 1
+            if not times.rendering:
+                times.template += time.perf_counter() - start - (times.sql - sql)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.current() is not None:
+            context._profiler_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        times = self.current()
+        if times is not None and hasattr(context, '_profiler_start'):
+            times.queries += 1
+            times.sql += time.perf_counter() - context._profiler_start
+
+    def __call__(self, environ, start_response):
+        times = self.local.times = RequestTimes()
+        start = time.perf_counter()
+
+        def finish():
+            self.local.times = None
+            self.record(times, time.perf_counter() - start)
+        try:
+            response = self.wsgi_app(environ, start_response)
+        except BaseException:
+            finish()
+            raise
+        return ClosingIterator(response, finish)
+
+    def record(self, times, total):
+        with self.lock:
+            if times.route not in self.routes:
+                self.routes[times.route] = deque(maxlen=self.samples)
+            self.routes[times.route].append((total, times.sql, times.template, times.queries))
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+
+    def stats(self):
+        """Per route request count, p50/p95/max latency and mean SQL time, template time and query count; times in ms"""
+        with self.lock:
+            routes = {route: list(samples) for route, samples in self.routes.items()}
+        stats = {}
+        for route, samples in sorted(routes.items(), key=lambda item: str(item[0])):
+            totals = sorted(sample[0] for sample in samples)
+            count = len(samples)
+            stats[str(route)] = {
+                'requests': count,
+                'p50_ms': round(percentile(totals, 50) * 1000, 2),
+                'p95_ms': round(percentile(totals, 95) * 1000, 2),
+                'max_ms': round(totals[-1] * 1000, 2),
+                'sql_ms': round(sum(sample[1] for sample in samples) / count * 1000, 2),
+                'template_ms': round(sum(sample[2] for sample in samples) / count * 1000, 2),
+                'queries': round(sum(sample[3] for sample in samples) / count, 1),
+            }
+        return stats
+
+def percentile(ordered, percent):
+    """Nearest-rank percentile of a sorted non-empty list"""
+    return ordered[max(0, -(-len(ordered) * percent // 100) - 1)]
+
+def get_profiler():
+    """The app's RequestProfiler, if PROFILE_REQUESTS is enabled"""
+    return current_app.extensions.get('profiler')
@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from datetime import datetime, timedelta
+
 from flask_script import Manager, Shell
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
 
 from backend import app, db
-from backend.lib import sync
+from backend.lib import benchmark, journal, local, reports, search, sync
+from backend.lib.models import Follower, HttpCache, Package, PackageVersion
 
 # TODO: Replace this with flask 0.11 "flask" CLI and the extra commands support via click therein - http://flask.pocoo.org/docs/0.11/cli/
 # TODO: This would then allow FLASK_DEBUG=1 automatically reloading the server on code changes when launched with "flask run"
@@ -21,6 +26,47 @@ def init():
     """Initialize empty database with tables"""
     db.create_all()
 
+@manager.command
+def upgrade():
+    """Upgrade an existing database to the current schema: create missing tables, columns and indexes"""
+    engine = db.engine
+    existing_tables = set(inspect(engine).get_table_names())
+    db.create_all()
+    inspector = inspect(engine)
+    added = set((table.name, column.name) for table in db.metadata.sorted_tables if table.name not in existing_tables for column in table.columns)
+    for table in db.metadata.sorted_tables:
+        existing_columns = set(column['name'] for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name not in existing_columns:
+                # New columns have to be nullable or come with a server_default for this to work
+                added.add((table.name, column.name))
+                print("Adding column %s.%s" % (table.name, column.name))
+                engine.execute("ALTER TABLE %s ADD COLUMN %s" % (table.name, CreateColumn(column).compile(dialect=engine.dialect)))
+        existing_indexes = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            if index.unique and table.name.endswith('_rel') and engine.name == 'sqlite':
+                # Older syncs could leave duplicate association rows behind, which would block the unique index
+                cols = ", ".join(col.name for col in index.columns)
+                engine.execute("DELETE FROM %s WHERE rowid NOT IN (SELECT MIN(rowid) FROM %s GROUP BY %s)" % (table.name, table.name, cols))
+            print("Creating index %s" % index.name)
+            index.create(engine)
+    # Derived data for columns that were just added, or versions synced before they were
+    if db.session.query(PackageVersion.id).filter(PackageVersion.stable_arches == None).first():
+        sync.rebuild_arch_masks()
+    if db.session.query(PackageVersion.id).filter(PackageVersion.sort_key == None).first():
+        sync.fill_version_sort_keys()
+    if ('maintainer_project_membership_rel', 'inherit_members') in added:
+        # Only known from projects.xml, so have the next sync_projects fetch it even if unchanged
+        print("Forgetting projects.xml validators, so the next sync_projects fills in subproject inherit-members")
+        HttpCache.query.filter_by(url=sync.proj_url).delete()
+    sync.rebuild_maintainer_closure()
+    indexed = search.index_new_packages()
+    if indexed:
+        print("Indexed %d packages for search" % indexed)
+    db.session.commit()
+
 @manager.command
 def sync_gentoo():
     """Synchronize Gentoo data"""
@@ -39,20 +85,75 @@ def sync_categories():
     """Synchronize only Gentoo categories data"""
     sync.sync_categories()
 
-@manager.command
-def sync_packages():
+@manager.option('-w', '--workers', dest='workers', type=int, default=1, help="Number of processes downloading and decoding category data")
+def sync_packages(workers):
     """Synchronize only Gentoo packages base data (without details)"""
-    sync.sync_packages()
+    sync.sync_packages(workers=workers)
 
-@manager.command
-def sync_pkgcheck():
+@manager.option('--full', dest='full', action='store_true', default=False, help="Replace all stored results instead of applying only the differences")
+def sync_pkgcheck(full):
     """Synchronize dev-util/pkgcheck static analysis data"""
-    sync.sync_pkgcheck()
+    sync.sync_pkgcheck(full=full)
 
-@manager.command
-def sync_versions():
+@manager.option('-j', '--jobs', dest='jobs', type=int, default=sync.SYNC_FETCH_JOBS, help="Number of concurrent package downloads (threads) per process")
+@manager.option('-r', '--rate-limit', dest='rate_limit', type=float, default=sync.SYNC_RATE_LIMIT, help="Maximum requests per second per host (0 for unlimited)")
+@manager.option('-w', '--workers', dest='workers', type=int, default=1, help="Number of processes, sharded by category, each running --jobs downloads")
+def sync_versions(jobs, rate_limit, workers):
     """Synchronize only Gentoo package details"""
-    sync.sync_versions()
+    sync.sync_versions(jobs=jobs, rate_limit=rate_limit, workers=workers)
+
+@manager.command
+def sync_local(path):
+    """Synchronize categories and package details from a local gentoo repository checkout instead of packages.gentoo.org"""
+    local.sync_local(path)
+
+@manager.command
+def reindex_search():
+    """Rebuild the package search index from scratch"""
+    search.rebuild_search_index()
+    db.session.commit()
+
+@manager.option('-r', '--reference', dest='reference', default='amd64', help="Arch to measure the lag of the others against")
+@manager.option('-a', '--arch', dest='arch', default=None, help="Only report this arch, listing the versions")
+def keyword_report(reference, arch):
+    """Show how far each arch lags behind the reference arch and its stabilization candidates"""
+    return reports.print_keyword_report(reference, arch)
+
+@manager.option('-n', '--limit', dest='limit', type=int, default=10, help="Number of runs to show per source")
+@manager.option('--stalled-after', dest='stalled_minutes', type=int, default=30, help="Minutes without a checkpoint after which a running sync counts as stalled")
+def sync_status(limit, stalled_minutes):
+    """Show recent sync runs; exits with 1 if the latest run of any source failed or stalled"""
+    return journal.print_sync_status(limit, stalled_minutes)
+
+@manager.option('-d', '--days', dest='days', type=int, default=365, help="Days without using or changing their follows after which a visitor's follows are deleted")
+def prune_followers(days):
+    """Delete the follows of visitors that haven't used or changed them for a long time"""
+    count = Follower.prune(datetime.utcnow() - timedelta(days=days))
+    db.session.commit()
+    print("Deleted %d followers unused for %d days" % (count, days))
+
+@manager.option('-s', '--seed', dest='seed', type=int, default=0, help="Random seed; the same seed gives the same tree")
+@manager.option('-p', '--packages', dest='packages_per_category', type=int, default=125, help="Packages per category")
+@manager.option('-c', '--categories', dest='categories', type=int, default=160, help="Number of categories")
+def bench_generate(categories, packages_per_category, seed):
+    """Fill an empty database with a synthetic tree-sized data set for ./manage.py benchmark_pages"""
+    db.create_all()
+    if db.session.query(Package.id).first():
+        print("The database already has packages; point GRUMPY_DATABASE_URL at an empty one")
+        return 1
+    benchmark.generate_tree(categories=categories, packages_per_category=packages_per_category, seed=seed)
+
+@manager.option('-n', '--requests', dest='requests', type=int, default=20, help="Measured requests per page")
+@manager.option('--page-cache', dest='page_cache', action='store_true', default=False, help="Keep the page cache enabled")
+@manager.option('--save', dest='save', default=None, help="Write the results as JSON to this file")
+@manager.option('--compare', dest='compare', default=None, help="JSON results of an earlier run; exits with 1 if a page got slower or runs more queries")
+@manager.option('--tolerance', dest='tolerance', type=float, default=1.5, help="Factor by which p95 latency may grow before it counts as a regression")
+def benchmark_pages(requests, page_cache, save, compare, tolerance):
+    """Measure p50/p95 latency, SQL and template time and query count of every page"""
+    stats = benchmark.run_benchmark(requests, page_cache)
+    if save:
+        benchmark.save_benchmark(stats, save)
+    return benchmark.print_benchmark(stats, benchmark.load_benchmark(compare) if compare else None, tolerance)
 
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# backend reads the database URL when imported, so point it at a scratch SQLite file first
+_db_dir = tempfile.mkdtemp(prefix='grumpy-test-')
+os.environ['GRUMPY_DATABASE_URL'] = 'sqlite:///' + os.path.join(_db_dir, 'grumpy.db')
+os.environ.pop('GRUMPY_SETTINGS', None)
+
+from backend import app as grumpy_app, db
+from backend.lib import sync
+
+# Set before the engine gets created, so that queries are recorded for X-Query-Count
+grumpy_app.config['TESTING'] = True
+grumpy_app.config['WTF_CSRF_ENABLED'] = False
+grumpy_app.config['PAGE_CACHE_SIZE'] = 0
+
+
+class StandInServer(object):
+    """Serves the sync sources like packages.gentoo.org and api.gentoo.org, with ETags honoured through If-None-Match"""
+    def __init__(self):
+        self.documents = {} # path -> (body, etag)
+        self.requests = [] # (path, If-None-Match, status)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body, etag = server.documents.get(self.path, (None, None))
+                if_none_match = self.headers.get('If-None-Match')
+                status = 404 if body is None else 304 if if_none_match == etag else 200
+                server.requests.append((self.path, if_none_match, status))
+                self.send_response(status)
+                if body is not None:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body) if status == 200 else 0))
+                self.end_headers()
+                if status == 200:
+                    self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = "http://127.0.0.1:%d/" % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def set_document(self, path, body, etag):
+        self.documents[path] = (body.encode('utf-8'), etag)
+
+    def statuses(self):
+        return sorted(status for path, if_none_match, status in self.requests)
+
+@pytest.fixture
+def app():
+    """The grumpy app on an emptied database, with no cached pages or per-generation data left over"""
+    with grumpy_app.app_context():
+        db.drop_all()
+        db.create_all()
+    grumpy_app.extensions.pop('page_cache', None)
+    grumpy_app.extensions.pop('generation_cache', None)
+    yield grumpy_app
+    with grumpy_app.app_context():
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def server(monkeypatch):
+    """A running StandInServer the syncs download from, serving projects.xml and the pkgcheck output.xml at the top"""
+    server = StandInServer()
+    server.thread.start()
+    monkeypatch.setattr(sync, 'pkg_url_base', server.url)
+    monkeypatch.setattr(sync, 'proj_url', server.url + 'projects.xml')
+    monkeypatch.setattr(sync, 'pkgcheck_url', server.url + 'output.xml')
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
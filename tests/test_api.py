@@ -0,0 +1,34 @@
+from backend import db
+from backend.lib import benchmark
+from backend.lib.models import Package
+from backend.lib.sync import mark_synced
+
+
+def test_api_answers_polls_with_a_current_etag_with_304(app, client):
+    with app.app_context():
+        benchmark.generate_tree(categories=2, packages_per_category=5, developers=20, projects=2, pkgcheck_results=10)
+        package = Package.query.first()
+        url = '/api/v1/package/%s' % package.full_name
+
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert response.json['name'] == package.name
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    # Only the sync generation is looked up, the view doesn't run
+    assert response.headers['X-Query-Count'] == '1'
+
+    # Errors get no validators to revalidate with
+    response = client.get('/api/v1/package/%s/missing' % package.category.name, headers={'If-None-Match': etag})
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
+
+    with app.app_context():
+        mark_synced('versions')
+        db.session.commit()
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+from backend import db
+from backend.lib import benchmark, local
+from backend.lib.models import Category, Maintainer, Package, SyncRun
+
+MAX_READ_SECONDS = 2.0 # a reader blocked behind the sync's transactions would wait for busy_timeout (10s) or fail
+
+
+def write_repo(path, categories=20, packages_per_category=100):
+    """Write a gentoo-style repository of two versions per package, with md5-cache entries"""
+    names = ["sync-cat%d" % i for i in range(categories)]
+    os.makedirs(os.path.join(path, 'profiles'))
+    with open(os.path.join(path, 'profiles', 'categories'), 'w') as f:
+        f.write("".join(name + "\n" for name in names))
+    for category in names:
+        os.makedirs(os.path.join(path, 'metadata', 'md5-cache', category))
+        for i in range(packages_per_category):
+            name = "pkg%d" % i
+            os.makedirs(os.path.join(path, category, name))
+            with open(os.path.join(path, category, name, 'metadata.xml'), 'w') as f:
+                f.write("<pkgmetadata><maintainer type=\"person\"><email>dev%d@gentoo.org</email></maintainer></pkgmetadata>" % (i % 50))
+            for version in ('1.0', '1.1'):
+                with open(os.path.join(path, category, name, "%s-%s.ebuild" % (name, version)), 'w') as f:
+                    f.write("EAPI=8\n")
+                with open(os.path.join(path, 'metadata', 'md5-cache', category, "%s-%s" % (name, version)), 'w') as f:
+                    f.write("DESCRIPTION=Package %s of %s\nKEYWORDS=amd64 ~arm64 x86\n" % (name, category))
+    return packages_per_category * categories
+
+def test_pages_are_served_while_syncing(app, client, tmp_path):
+    repo = str(tmp_path / 'gentoo')
+    package_count = write_repo(repo)
+    with app.app_context():
+        assert db.session.execute(db.text("PRAGMA journal_mode")).scalar() == 'wal'
+        benchmark.generate_tree(categories=5, packages_per_category=20, developers=20, projects=3, pkgcheck_results=100)
+        category = Category.query.order_by(Category.name).first()
+        urls = ['/', '/category/%s' % category.name, '/package/%s' % category.packages[0].full_name, '/maintainers',
+                '/api/v1/category/%s' % category.name, '/search?q=synthetic']
+        follows = [str(id) for id, in db.session.query(Maintainer.id).order_by(Maintainer.id).limit(5)]
+
+    errors = []
+    def sync():
+        with app.app_context():
+            try:
+                local.sync_local(repo)
+            except Exception as e:
+                errors.append(e)
+    failures = []
+    def save_follows():
+        # Saving follows writes too, so has to wait for the sync's transactions instead of failing with "database is locked"
+        follows_client = app.test_client()
+        while writer.is_alive():
+            try:
+                response = follows_client.post('/setup/', data={'maintainers': follows})
+            except Exception as e:
+                errors.append(e)
+                return
+            if response.status_code != 302:
+                failures.append(('/setup/', response.status_code))
+    writer = threading.Thread(target=sync)
+    saver = threading.Thread(target=save_follows)
+    writer.start()
+    saver.start()
+
+    latencies = []
+    rounds = 0
+    while writer.is_alive():
+        rounds += 1
+        for url in urls:
+            start = time.monotonic()
+            response = client.get(url)
+            latencies.append(time.monotonic() - start)
+            if response.status_code != 200:
+                failures.append((url, response.status_code))
+    writer.join()
+    saver.join()
+
+    assert errors == []
+    assert failures == []
+    with app.app_context():
+        assert SyncRun.query.filter_by(source='local').one().status == 'finished'
+        assert Package.query.join(Package.category).filter(Category.name.like('sync-cat%')).count() == package_count
+    # The sync ran long enough to have readers overlap several of its commits
+    assert rounds >= 5
+    assert max(latencies) < MAX_READ_SECONDS
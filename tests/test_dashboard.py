@@ -0,0 +1,59 @@
+from backend import db
+from backend.lib import benchmark, models
+from frontend.grumpy import followed_packages_overview
+
+
+def reference_overview(maintainers):
+    """followed_packages_overview computed the plain way, through the ORM relationships of every package"""
+    closure = models.maintainer_package_closure_table
+    summary = {}
+    attention = {}
+    for maintainer in maintainers:
+        totals = summary[maintainer.id] = {'packages': 0, 'keyword_gaps': 0, 'pkgcheck': 0}
+        for package_id, in db.session.query(closure.c.package_id).filter(closure.c.maintainer_id == maintainer.id):
+            package = models.Package.query.get(package_id)
+            stable = set(keyword.name for version in package.versions for keyword in version.keywords if not keyword.name.startswith('~'))
+            testing = set(keyword.name[1:] for version in package.versions for keyword in version.keywords if keyword.name.startswith('~'))
+            keyword_gaps = sorted(testing - stable) if stable else []
+            pkgcheck = {}
+            for violation in package.pkgcheck_violations:
+                pkgcheck[violation.violationclass] = pkgcheck.get(violation.violationclass, 0) + 1
+            totals['packages'] += 1
+            totals['keyword_gaps'] += 1 if keyword_gaps else 0
+            totals['pkgcheck'] += sum(pkgcheck.values())
+            if keyword_gaps or pkgcheck:
+                entry = attention.setdefault(package.full_name, {'full_name': package.full_name, 'maintainer_ids': [],
+                                                                 'keyword_gaps': keyword_gaps, 'pkgcheck': pkgcheck})
+                entry['maintainer_ids'].append(maintainer.id)
+    return summary, [attention[full_name] for full_name in sorted(attention)]
+
+def test_overview_of_followed_maintainers(app):
+    with app.app_context():
+        benchmark.generate_tree(categories=3, packages_per_category=30, versions_per_package=3, arches=8, developers=20, projects=4,
+                                pkgcheck_results=200)
+        maintainers = models.Maintainer.query.order_by(models.Maintainer.email).all()
+        followed = [maintainers[0], maintainers[3]] + [maintainer for maintainer in maintainers if maintainer.is_project][:2]
+    with app.test_request_context('/dashboard/?per_page=5'):
+        summary, expected = reference_overview(followed)
+        assert len(expected) > 10
+        pages = []
+        after = None
+        while True:
+            page_summary, packages, next_key = followed_packages_overview(followed, after)
+            assert page_summary == summary
+            pages.extend(packages)
+            if not next_key:
+                break
+            after, = next_key
+        assert pages == expected
+
+def test_dashboard_page(app, client):
+    with app.app_context():
+        benchmark.generate_tree(categories=2, packages_per_category=10, developers=20, projects=2, pkgcheck_results=50)
+        maintainer = models.Maintainer.query.filter_by(is_project=True).first()
+        maintainer_id, email = maintainer.id, maintainer.email
+    assert b"not following any maintainers" in client.get('/dashboard/').data
+    client.post('/setup/', data={'maintainers': [str(maintainer_id)]})
+    response = client.get('/dashboard/')
+    assert response.status_code == 200
+    assert email.encode() in response.data
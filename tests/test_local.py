@@ -0,0 +1,156 @@
+import os
+import shutil
+
+import pytest
+
+from backend.lib import local, search
+from backend import db
+from backend.lib.models import Category, HttpCache, Package, SyncRun, SyncState, maintainer_package_closure_table, \
+    package_version_keywords_rel_table
+
+FIXTURE_REPO = os.path.join(os.path.dirname(__file__), 'fixtures', 'gentoo')
+
+
+@pytest.fixture
+def repo(tmp_path):
+    """A copy of the fixture repository that tests can change"""
+    path = str(tmp_path / 'gentoo')
+    shutil.copytree(FIXTURE_REPO, path)
+    return path
+
+def rewrite(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    # Coarse filesystem timestamps could otherwise leave the mtime as it was
+    mtime = os.stat(path).st_mtime + 10
+    os.utime(path, (mtime, mtime))
+
+def package(full_name):
+    category_name, name = full_name.split('/')
+    return Package.query.join(Package.category).filter(Category.name == category_name, Package.name == name).one()
+
+def versions(full_name):
+    return {version.version: sorted(keyword.name for keyword in version.keywords) for version in package(full_name).versions}
+
+def updated_packages(output):
+    return sorted(line.split(": ", 1)[1] for line in output.splitlines() if line.startswith("Updating package: "))
+
+def test_initial_import(app, repo, capsys):
+    with app.app_context():
+        local.sync_local(repo)
+        assert updated_packages(capsys.readouterr().out) == ['app-misc/screen', 'app-misc/tmux', 'dev-lang/python']
+        assert Category.query.filter_by(name='app-misc').one().description == "The app-misc category contains miscellaneous applications."
+
+        screen = package('app-misc/screen')
+        assert screen.description == "screen manager with VT100/ANSI terminal emulation"
+        assert versions('app-misc/screen') == {'4.9.1': ['amd64', 'arm', 'arm64', 'ppc', 'x86'], '4.99.0': ['~amd64', '~arm64']}
+        assert sorted((maintainer.email, maintainer.is_project) for maintainer in screen.maintainers) == [
+            ('base-system@gentoo.org', True), ('swegener@gentoo.org', False)]
+        # Without an md5-cache entry the ebuild itself is read
+        python = package('dev-lang/python')
+        assert python.description == "An interpreted, interactive, object-oriented programming language"
+        assert versions('dev-lang/python') == {'3.12.4': ['amd64', 'x86', '~arm64']}
+        run = SyncRun.query.filter_by(source='local').one()
+        assert (run.status, run.items_processed, run.items_failed) == ('finished', 3, 0)
+
+def test_unchanged_rescan_is_skipped(app, repo, capsys):
+    with app.app_context():
+        local.sync_local(repo)
+        synced = {full_name: package(full_name).last_sync_ts for full_name in ['app-misc/screen', 'app-misc/tmux', 'dev-lang/python']}
+        capsys.readouterr()
+
+        local.sync_local(repo)
+        output = capsys.readouterr().out
+        assert updated_packages(output) == []
+        assert "Synced 3 packages (3 unchanged)" in output
+        assert {full_name: package(full_name).last_sync_ts for full_name in synced} == synced
+
+def test_changed_file_is_rescanned(app, repo, capsys):
+    with app.app_context():
+        local.sync_local(repo)
+        capsys.readouterr()
+
+        rewrite(os.path.join(repo, 'metadata', 'md5-cache', 'app-misc', 'tmux-3.4'),
+                "DESCRIPTION=Terminal multiplexer\nEAPI=8\nKEYWORDS=amd64 x86 ~arm64\nSLOT=0\n")
+
+        local.sync_local(repo)
+        output = capsys.readouterr().out
+        assert updated_packages(output) == ['app-misc/tmux']
+        assert "Synced 3 packages (2 unchanged)" in output
+        assert versions('app-misc/tmux') == {'3.4': ['amd64', 'x86', '~arm64']}
+
+def test_fingerprint_keys_fit_for_deep_checkouts(app, tmp_path):
+    deep = tmp_path.joinpath(*['checkouts-of-the-gentoo-repository'] * 8)
+    shutil.copytree(FIXTURE_REPO, str(deep))
+    assert len(str(deep)) > 255
+    with app.app_context():
+        local.sync_local(str(deep))
+        urls = [entry.url for entry in HttpCache.query]
+        assert len(urls) == 3
+        assert max(len(url) for url in urls) <= HttpCache.url.type.length
+
+def closure_rows():
+    return db.session.query(maintainer_package_closure_table).count()
+
+def test_closure_is_rebuilt_in_a_new_generation(app, repo):
+    with app.app_context():
+        local.sync_local(repo)
+        assert closure_rows() == 3
+        generation = SyncState.last_change()
+        # The generation has to change with the closure commit, so that pages cached before are dropped along with it
+        assert SyncState.query.get('local').updated_ts == generation
+
+        # An interrupted run may have committed package changes without rebuilding the closure
+        db.session.execute(maintainer_package_closure_table.delete())
+        SyncRun.query.filter_by(source='local').one().status = 'failed'
+        db.session.commit()
+        local.sync_local(repo)
+        assert closure_rows() == 3
+        assert SyncState.last_change() > generation
+
+        generation = SyncState.last_change()
+        local.sync_local(repo)
+        assert SyncState.last_change() == generation
+
+def test_removed_ebuilds(app, repo, capsys):
+    with app.app_context():
+        local.sync_local(repo)
+        capsys.readouterr()
+
+        os.remove(os.path.join(repo, 'app-misc', 'screen', 'screen-4.99.0.ebuild'))
+        os.remove(os.path.join(repo, 'metadata', 'md5-cache', 'app-misc', 'screen-4.99.0'))
+        os.remove(os.path.join(repo, 'app-misc', 'tmux', 'tmux-3.4.ebuild'))
+        shutil.rmtree(os.path.join(repo, 'dev-lang', 'python'))
+
+        local.sync_local(repo)
+        output = capsys.readouterr().out
+        assert updated_packages(output) == ['app-misc/screen']
+        assert "Removing versions of package: app-misc/tmux" in output
+        assert "Removing versions of package: dev-lang/python" in output
+        assert versions('app-misc/screen') == {'4.9.1': ['amd64', 'arm', 'arm64', 'ppc', 'x86']}
+        assert versions('app-misc/tmux') == {}
+        assert versions('dev-lang/python') == {}
+        assert db.session.query(package_version_keywords_rel_table).count() == 5
+
+        # Nothing left to remove on the next run
+        local.sync_local(repo)
+        assert "Removing versions" not in capsys.readouterr().out
+
+def test_invalid_maintainers(app, repo, capsys):
+    rewrite(os.path.join(repo, 'app-misc', 'tmux', 'metadata.xml'),
+            '<pkgmetadata><maintainer type="person"><name>No Email</name></maintainer></pkgmetadata>')
+    with app.app_context():
+        local.sync_local(repo)
+        output = capsys.readouterr().out
+        assert "Package app-misc/tmux maintainer" in output
+        assert updated_packages(output) == ['app-misc/screen', 'dev-lang/python']
+        run = SyncRun.query.filter_by(source='local').one()
+        assert (run.status, run.items_processed, run.items_failed) == ('finished', 3, 1)
+        assert versions('app-misc/tmux') == {}
+        # Still searchable by name, and read again once fixed
+        assert [package.full_name for package in search.search_packages('tmux')] == ['app-misc/tmux']
+        rewrite(os.path.join(repo, 'app-misc', 'tmux', 'metadata.xml'),
+                '<pkgmetadata><maintainer type="person"><email>wired@gentoo.org</email></maintainer></pkgmetadata>')
+        local.sync_local(repo)
+        assert updated_packages(capsys.readouterr().out) == ['app-misc/tmux']
+        assert [maintainer.email for maintainer in package('app-misc/tmux').maintainers] == ['wired@gentoo.org']
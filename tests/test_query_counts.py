@@ -0,0 +1,41 @@
+from backend import db
+from backend.lib import benchmark
+from backend.lib.models import Category, Maintainer, Package, PkgCheck
+
+SIZES = [
+    dict(categories=2, packages_per_category=3, versions_per_package=2, developers=20, projects=2, pkgcheck_results=10),
+    dict(categories=2, packages_per_category=60, versions_per_package=6, developers=20, projects=2, pkgcheck_results=1000),
+]
+
+
+def page_urls():
+    """The largest category, the maintainer of the most packages, and the package with the most pkgcheck results"""
+    category, = db.session.query(Category.name).join(Category.packages).group_by(Category.name) \
+        .order_by(db.func.count().desc()).first()
+    email, = db.session.query(Maintainer.email).join(Maintainer.directly_maintained_packages).group_by(Maintainer.email) \
+        .order_by(db.func.count().desc()).first()
+    package_id, = db.session.query(PkgCheck.package_id).group_by(PkgCheck.package_id).order_by(db.func.count().desc()).first()
+    return {
+        'category': '/category/%s' % category,
+        'maintainer': '/maintainer/%s' % email,
+        'package': '/package/%s' % Package.query.get(package_id).full_name,
+    }
+
+def query_counts(app, size):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        benchmark.generate_tree(arches=10, **size)
+        urls = page_urls()
+    client = app.test_client()
+    counts = {}
+    for page, url in urls.items():
+        client.get(url) # warms up the per-generation caches
+        response = client.get(url)
+        assert response.status_code == 200
+        counts[page] = int(response.headers['X-Query-Count'])
+    return counts
+
+def test_page_queries_independent_of_size(app):
+    small, large = [query_counts(app, size) for size in SIZES]
+    assert small == large
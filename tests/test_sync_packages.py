@@ -0,0 +1,23 @@
+import json
+
+import pytest
+
+from backend import db
+from backend.lib import search, sync
+from backend.lib.models import Category, Package, SyncRun
+
+
+def test_new_packages_are_searchable_per_category(app, server):
+    server.set_document('/categories/app-misc.json', json.dumps({'packages': [{'name': 'screen'}, {'name': 'tmux'}]}), '"a1"')
+    server.set_document('/categories/dev-lang.json', "{not json", '"d1"')
+    with app.app_context():
+        for name in ('app-misc', 'dev-lang'):
+            db.session.add(Category(name=name, description=name))
+        db.session.commit()
+
+        # The run fails on dev-lang, after app-misc is committed, which has to include its search index entries
+        with pytest.raises(ValueError):
+            sync.sync_packages()
+        assert SyncRun.query.filter_by(source='packages').one().status == 'failed'
+        assert Package.query.count() == 2
+        assert [package.full_name for package in search.search_packages('tmux')] == ['app-misc/tmux']
@@ -0,0 +1,86 @@
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from backend import db
+from backend.lib import local, sync
+from backend.lib.models import PkgCheck, SyncRun, SyncState, pkg_check_staging_table
+
+FIXTURE_REPO = os.path.join(os.path.dirname(__file__), 'fixtures', 'gentoo')
+
+
+def report(*results):
+    """output.xml with (category, package, version, class, message) results"""
+    return "<checks>%s</checks>" % "".join(
+        "<result><category>%s</category><package>%s</package>%s<class>%s</class><msg>%s</msg></result>" % (
+            category, package, "<version>%s</version>" % version if version else "", violationclass, message)
+        for category, package, version, violationclass, message in results)
+
+def stored_results():
+    return sorted((check.package.name, check.version.version if check.version else '', check.violationclass, check.message)
+                  for check in PkgCheck.query)
+
+FIRST = [
+    ('app-misc', 'screen', '4.9.1', 'RedundantVersion', 'old'),
+    ('app-misc', 'screen', '4.99.0', 'UnstableOnlyKeywords', 'unstable'),
+    ('app-misc', 'tmux', None, 'MissingRemoteId', 'remote'),
+]
+
+@pytest.fixture
+def tree(app):
+    with app.app_context():
+        local.sync_local(FIXTURE_REPO)
+    return app
+
+def test_reports_are_diffed(tree, server, capsys):
+    server.set_document('/output.xml', report(*FIRST), '"r1"')
+    with tree.app_context():
+        sync.sync_pkgcheck()
+        assert stored_results() == [
+            ('screen', '4.9.1', 'redundantversion', 'old'),
+            ('screen', '4.99.0', 'unstableonlykeywords', 'unstable'),
+            ('tmux', '', 'missingremoteid', 'remote'),
+        ]
+        ids = dict((check.message, check.id) for check in PkgCheck.query)
+
+        # One result vanished, one is new and one is now reported twice
+        server.set_document('/output.xml', report(FIRST[0], FIRST[2], FIRST[2], ('dev-lang', 'python', '3.12.4', 'DeprecatedEapi', 'eapi')), '"r2"')
+        sync.sync_pkgcheck()
+        assert stored_results() == [
+            ('python', '3.12.4', 'deprecatedeapi', 'eapi'),
+            ('screen', '4.9.1', 'redundantversion', 'old'),
+            ('tmux', '', 'missingremoteid', 'remote'),
+            ('tmux', '', 'missingremoteid', 'remote'),
+        ]
+        # Unchanged results are left alone
+        assert PkgCheck.query.get(ids['old']).message == 'old'
+        assert db.session.query(pkg_check_staging_table).count() == 0
+
+        capsys.readouterr()
+        sync.sync_pkgcheck(full=True)
+        assert "4 added, 4 removed, 0 unchanged" in capsys.readouterr().out
+        assert len(stored_results()) == 4
+
+def test_interrupted_run_leaves_the_stored_report(tree, server, monkeypatch):
+    server.set_document('/output.xml', report(*FIRST), '"r1"')
+    with tree.app_context():
+        sync.sync_pkgcheck()
+        generation = SyncState.last_change()
+        before = stored_results()
+
+        # Broken off after a few committed batches of new results
+        monkeypatch.setattr(sync, 'PKGCHECK_BATCH_SIZE', 2)
+        new_results = [('app-misc', 'tmux', '3.4', 'BadDescription', "message %d" % i) for i in range(5)]
+        server.set_document('/output.xml', report(*FIRST + new_results)[:-len("</checks>")] + "<result>", '"r2"')
+        with pytest.raises(ET.ParseError):
+            sync.sync_pkgcheck()
+        assert SyncRun.query.filter_by(source='pkgcheck').order_by(SyncRun.id.desc()).first().status == 'failed'
+        assert db.session.query(pkg_check_staging_table).count() == 4
+        assert stored_results() == before
+        assert SyncState.last_change() == generation
+
+        server.set_document('/output.xml', report(*FIRST + new_results), '"r3"')
+        sync.sync_pkgcheck()
+        assert len(stored_results()) == 8
+        assert db.session.query(pkg_check_staging_table).count() == 0
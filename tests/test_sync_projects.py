@@ -0,0 +1,70 @@
+from backend import db
+from backend.lib import sync
+from backend.lib.models import Maintainer, maintainer_project_membership_rel_table, project_member_closure_table
+
+
+def project_xml(email, members=(), subprojects=()):
+    return ("<project><email>%s</email><name>%s</name>%s%s</project>" % (email, email.split('@')[0],
+            "".join("<member><email>%s</email><name>%s</name></member>" % (member, member.split('@')[0].title()) for member in members),
+            "".join('<subproject ref="%s" inherit-members="%d"/>' % (subproject, inherit) for subproject, inherit in subprojects)))
+
+def set_projects(server, etag, *projects):
+    server.set_document('/projects.xml', "<?xml version='1.0'?><projects>%s</projects>" % "".join(projects), etag)
+
+def memberships():
+    rel = maintainer_project_membership_rel_table
+    emails = dict(db.session.query(Maintainer.id, Maintainer.email))
+    return sorted((emails[project_id], emails[maintainer_id], inherit_members)
+                  for project_id, maintainer_id, inherit_members in db.session.query(rel.c.project_id, rel.c.maintainer_id, rel.c.inherit_members))
+
+def closure():
+    members = project_member_closure_table
+    emails = dict(db.session.query(Maintainer.id, Maintainer.email))
+    return sorted((emails[project_id], emails[maintainer_id]) for project_id, maintainer_id in db.session.query(members.c.project_id, members.c.maintainer_id))
+
+
+def test_upsert_keeps_existing_names(app):
+    with app.app_context():
+        sync.upsert(Maintainer, [{'email': 'alice@gentoo.org', 'is_project': False, 'name': 'Alice'},
+                                 {'email': 'bob@gentoo.org', 'is_project': False, 'name': None}], ['email'], keep_existing=['name'])
+        # Re-run with the names missing, bob's now known, and alice turned into a project
+        sync.upsert(Maintainer, [{'email': 'alice@gentoo.org', 'is_project': True, 'name': None},
+                                 {'email': 'bob@gentoo.org', 'is_project': False, 'name': 'Bob'}], ['email'], update=['is_project'], keep_existing=['name'])
+        db.session.commit()
+        assert sorted(db.session.query(Maintainer.email, Maintainer.is_project, Maintainer.name)) == [
+            ('alice@gentoo.org', True, 'Alice'), ('bob@gentoo.org', False, 'Bob')]
+
+def test_upsert_merges_duplicate_keys_in_one_batch(app):
+    with app.app_context():
+        # Like a member of several projects, listed with a name only in some
+        sync.upsert(Maintainer, [{'email': 'alice@gentoo.org', 'is_project': False, 'name': 'Alice'},
+                                 {'email': 'alice@gentoo.org', 'is_project': False, 'name': None},
+                                 {'email': 'bob@gentoo.org', 'is_project': False, 'name': None},
+                                 {'email': 'bob@gentoo.org', 'is_project': False, 'name': 'Bob'}], ['email'], keep_existing=['name'])
+        db.session.commit()
+        assert sorted(db.session.query(Maintainer.email, Maintainer.name)) == [('alice@gentoo.org', 'Alice'), ('bob@gentoo.org', 'Bob')]
+
+def test_sync_projects_with_changed_membership(app, server):
+    set_projects(server, '"p1"',
+                 project_xml('base@gentoo.org', members=['alice@gentoo.org', 'bob@gentoo.org'], subprojects=[('sub@gentoo.org', 1)]),
+                 project_xml('sub@gentoo.org', members=['carol@gentoo.org']))
+    with app.app_context():
+        sync.sync_projects()
+        assert memberships() == [('base@gentoo.org', 'alice@gentoo.org', False), ('base@gentoo.org', 'bob@gentoo.org', False),
+                                 ('base@gentoo.org', 'sub@gentoo.org', True), ('sub@gentoo.org', 'carol@gentoo.org', False)]
+        assert closure() == [('base@gentoo.org', 'alice@gentoo.org'), ('base@gentoo.org', 'bob@gentoo.org'),
+                             ('base@gentoo.org', 'carol@gentoo.org'), ('sub@gentoo.org', 'carol@gentoo.org')]
+
+        # bob leaves, carol moves up from the subproject, which isn't inherited anymore and gains dave
+        set_projects(server, '"p2"',
+                     project_xml('base@gentoo.org', members=['alice@gentoo.org', 'carol@gentoo.org'], subprojects=[('sub@gentoo.org', 0)]),
+                     project_xml('sub@gentoo.org', members=['dave@gentoo.org']))
+        sync.sync_projects()
+        assert memberships() == [('base@gentoo.org', 'alice@gentoo.org', False), ('base@gentoo.org', 'carol@gentoo.org', False),
+                                 ('base@gentoo.org', 'sub@gentoo.org', False), ('sub@gentoo.org', 'dave@gentoo.org', False)]
+        assert closure() == [('base@gentoo.org', 'alice@gentoo.org'), ('base@gentoo.org', 'carol@gentoo.org'),
+                             ('sub@gentoo.org', 'dave@gentoo.org')]
+        # Names given once are kept, and every maintainer is stored once
+        assert db.session.query(Maintainer.name).filter_by(email='bob@gentoo.org').scalar() == 'Bob'
+        assert Maintainer.query.count() == 6
+    assert server.statuses() == [200, 200]
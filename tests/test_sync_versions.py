@@ -0,0 +1,87 @@
+import json
+from datetime import datetime
+
+from backend import db
+from backend.lib import sync
+from backend.lib.models import Category, HttpCache, Package, SyncRun
+
+PACKAGES = ['dev-lang/python', 'dev-lang/perl', 'app-misc/screen', 'app-misc/tmux', 'app-misc/mc']
+
+
+def set_package(server, full_name, description, versions, etag):
+    server.set_document('/packages/%s.json' % full_name, json.dumps({
+        'description': description,
+        'maintainers': [{'email': 'Dev@gentoo.org', 'type': 'person', 'name': "A Developer"}],
+        'versions': [{'version': version, 'keywords': keywords} for version, keywords in versions],
+    }), etag)
+
+def add_packages(full_names):
+    for full_name in full_names:
+        category_name, name = full_name.split('/')
+        category = Category.query.filter_by(name=category_name).first() or Category(name=category_name, description=category_name)
+        db.session.add(Package(category=category, name=name))
+    db.session.commit()
+
+def expire_last_sync():
+    """Make all packages due again, as if SYNC_BUFFER_SECS had passed"""
+    Package.query.update({Package.last_sync_ts: datetime.utcfromtimestamp(0)})
+    db.session.commit()
+
+def package(full_name):
+    category_name, name = full_name.split('/')
+    return Package.query.join(Package.category).filter(Category.name == category_name, Package.name == name).one()
+
+def test_sync_versions_fetches_conditionally(app, server, capsys):
+    for i, full_name in enumerate(PACKAGES):
+        set_package(server, full_name, "Package %d" % i, [('1.0', ['amd64', '~x86']), ('1.1', ['~amd64'])], '"v1-%d"' % i)
+    with app.app_context():
+        add_packages(PACKAGES)
+
+        sync.sync_versions(jobs=4, rate_limit=0)
+        assert server.statuses() == [200] * len(PACKAGES)
+        assert all(if_none_match is None for path, if_none_match, status in server.requests)
+        python = package('dev-lang/python')
+        assert python.description == "Package 0"
+        assert sorted(version.version for version in python.versions) == ['1.0', '1.1']
+        assert [maintainer.email for maintainer in python.maintainers] == ['dev@gentoo.org']
+        assert HttpCache.query.filter_by(url=server.url + 'packages/dev-lang/python.json').one().etag == '"v1-0"'
+        assert "packages/s" in capsys.readouterr().out
+
+        # Unchanged JSON: every request carries the stored ETag and is answered with 304
+        server.requests.clear()
+        expire_last_sync()
+        sync.sync_versions(jobs=4, rate_limit=0)
+        assert server.statuses() == [304] * len(PACKAGES)
+        assert all(if_none_match is not None for path, if_none_match, status in server.requests)
+        assert package('dev-lang/python').last_sync_ts > datetime.utcfromtimestamp(0)
+
+        # One package changed upstream: only it is downloaded again and updated
+        server.requests.clear()
+        set_package(server, 'app-misc/tmux', "Terminal multiplexer", [('3.4', ['amd64'])], '"v2"')
+        expire_last_sync()
+        sync.sync_versions(jobs=4, rate_limit=0)
+        assert server.statuses() == [200] + [304] * (len(PACKAGES) - 1)
+        tmux = package('app-misc/tmux')
+        assert tmux.description == "Terminal multiplexer"
+        assert [version.version for version in tmux.versions] == ['3.4']
+        assert package('dev-lang/python').description == "Package 0"
+        assert HttpCache.query.filter_by(url=server.url + 'packages/app-misc/tmux.json').one().etag == '"v2"'
+        assert [run.status for run in SyncRun.query.filter_by(source='versions')] == ['finished'] * 3
+
+def test_sync_versions_counts_failed_downloads(app, server):
+    set_package(server, 'dev-lang/python', "Python", [('3.12', ['amd64'])], '"v1"')
+    with app.app_context():
+        add_packages(['dev-lang/python', 'dev-lang/perl'])
+        sync.sync_versions(jobs=2, rate_limit=0)
+        assert package('dev-lang/python').description == "Python"
+        assert package('dev-lang/perl').last_sync_ts == datetime.utcfromtimestamp(0)
+        run = SyncRun.query.filter_by(source='versions').one()
+        assert (run.status, run.items_processed, run.items_failed) == ('finished', 2, 1)
+
+def test_sync_versions_sharded_over_processes(app, server):
+    for i, full_name in enumerate(PACKAGES):
+        set_package(server, full_name, "Package %d" % i, [('1.0', ['amd64'])], '"v1-%d"' % i)
+    with app.app_context():
+        add_packages(PACKAGES)
+        sync.sync_versions(jobs=2, rate_limit=0, workers=2)
+        assert sorted(package(full_name).description for full_name in PACKAGES) == ["Package %d" % i for i in range(len(PACKAGES))]
@@ -0,0 +1,42 @@
+import pytest
+
+from backend.lib.versions import try_version_sort_key, vercmp
+
+# (a, b, vercmp(a, b)), after the Package Manager Specification version comparison rules and examples
+VERCMP_CASES = [
+    ('1.10', '1.9', 1),
+    ('1.01', '1.1', -1),
+    ('1_rc', '1', -1),
+    ('1', '1_p', -1),
+    ('1_rc', '1_p', -1),
+    ('1a', '1', 1),
+    ('1-r1', '1', 1),
+    ('1-r0', '1', 0),
+    ('1.0', '1.00', 0),
+    ('1.010', '1.01', 0),
+    ('1.0', '1', 1),
+    ('01', '1', 0),
+    ('1.001', '1.01', -1),
+    ('1.0.2', '1.0.10', -1),
+    ('1_alpha', '1_beta', -1),
+    ('1_beta', '1_pre', -1),
+    ('1_pre', '1_rc', -1),
+    ('1_alpha', '1_alpha0', 0),
+    ('1_alpha', '1_alpha1', -1),
+    ('1_alpha2', '1_alpha10', -1),
+    ('1_rc1_p', '1_rc1', 1),
+    ('1b', '1a_p1', 1),
+    ('1.2-r2', '1.2-r10', -1),
+    ('2', '1.999', 1),
+]
+
+@pytest.mark.parametrize('a, b, expected', VERCMP_CASES)
+def test_vercmp(a, b, expected):
+    assert vercmp(a, b) == expected
+    assert vercmp(b, a) == -expected
+
+@pytest.mark.parametrize('version', ['', '1.', '.1', 'a1', '1_foo', '1-r', '1-rc1', '1.2.3b_pre1-r1-r2'])
+def test_invalid_versions(version):
+    assert try_version_sort_key(version) is None
+    with pytest.raises(ValueError):
+        vercmp(version, '1')